@@ -0,0 +1,68 @@
+"""
+Benchmarks summing events into a FlexDict with a pool of processes.
+
+Compares FlexDict.aggregate with 1 to 8 processes against incrementing
+every value through FlexDict.set in a loop.
+
+Usage:
+    python -m benchmarks.aggregate
+"""
+
+from random import Random
+from timeit import timeit
+
+from flexdict import FlexDict
+
+
+def events(count):
+    """Generates `count` fake access log lines."""
+    random = Random(0)
+    return [
+        '{} {} {}'.format(
+            'tenant%d' % random.randrange(50),
+            random.choice(['GET', 'POST', 'PUT', 'DELETE']),
+            '/api/v1/resource%d' % random.randrange(200),
+        )
+        for _ in range(count)
+    ]
+
+
+def parse(line):
+    """Maps a log line to the counters it increments."""
+    tenant, method, path = line.split()
+    return [
+        ([tenant, method, path], 1),
+        ([tenant, 'total'], 1),
+        (['methods', method], 1),
+    ]
+
+
+def naive(lines):
+    """Sums the counters in a single loop."""
+    flex = FlexDict()
+    for line in lines:
+        for keys, value in parse(line):
+            flex.set(keys, value, increment=True)
+    return flex
+
+
+def main():
+    """Runs the benchmarks."""
+    lines = events(500000)
+    expected = naive(lines)
+    print('set(increment=True) loop: {:.4f}s'.format(
+        timeit(lambda: naive(lines), number=1)
+    ))
+    for processes in (1, 2, 4, 8):
+        assert FlexDict.aggregate(
+            lines, mapper=parse, processes=processes, chunksize=50000
+        ) == expected
+        print('aggregate, {} process(es): {:.4f}s'.format(
+            processes, timeit(lambda: FlexDict.aggregate(
+                lines, mapper=parse, processes=processes, chunksize=50000
+            ), number=1)
+        ))
+
+
+if __name__ == '__main__':
+    main()
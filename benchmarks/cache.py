@@ -0,0 +1,53 @@
+"""
+Benchmarks the cost of bounding a FlexDict as a cache.
+
+Fills caches of growing sizes well past their bound, so that every write
+evicts a leaf, and reads back random keys. The time per operation stays
+flat as the cache grows since evictions never traverse it.
+
+Usage:
+    python -m benchmarks.cache
+"""
+
+from random import Random
+from timeit import timeit
+
+from flexdict import CachedFlexDict, FlexDict
+
+OPERATIONS = 100000
+
+
+def keys(count):
+    """Generates `count` random tenant, service and key paths."""
+    random = Random(0)
+    return [
+        ['tenant%d' % random.randrange(100),
+         'service%d' % random.randrange(10),
+         'key%d' % random.randrange(count)]
+        for _ in range(OPERATIONS)
+    ]
+
+
+def fill(cache, paths):
+    """Writes every path, then reads them all back."""
+    for i, path in enumerate(paths):
+        cache[path] = i
+    for path in paths:
+        cache.get(path)
+
+
+def main():
+    """Runs the benchmarks."""
+    for maxsize in (100, 1000, 10000):
+        paths = keys(maxsize * 10)
+        print('maxsize {:>5}: FlexDict: {:.4f}s  CachedFlexDict: {:.4f}s'
+              ''.format(
+                  maxsize, timeit(lambda: fill(FlexDict(), paths), number=1),
+                  timeit(lambda: fill(
+                      CachedFlexDict(maxsize=maxsize), paths
+                  ), number=1),
+              ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmarks the throughput of ConcurrentFlexDict with 1 to 32 threads.
+
+Each thread increments counters under a shared prefix and reads existing
+values, a tenth of the operations being writes. Free-threaded builds of
+Python scale with the number of threads, others are bound by the GIL.
+
+Usage:
+    python -m benchmarks.concurrency
+"""
+
+from threading import Thread
+from time import time
+
+from flexdict import ConcurrentFlexDict
+
+OPERATIONS = 200000
+
+
+def work(flex, operations):
+    """Mixes reads of existing values with increments."""
+    for i in range(operations):
+        if i % 10:
+            flex.get(['events', 'key%d' % (i % 100), 'count'])
+        else:
+            flex.set(['events', 'key%d' % (i % 100), 'count'], 1,
+                     increment=True)
+
+
+def run(threads):
+    """Splits the operations between `threads` and times them."""
+    flex = ConcurrentFlexDict()
+    for i in range(100):
+        flex['events', 'key%d' % i, 'count'] = 0
+    workers = [
+        Thread(target=work, args=(flex, OPERATIONS // threads))
+        for _ in range(threads)
+    ]
+    start = time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time() - start
+    total = sum(value for _, value in flex.flatten())
+    assert total == threads * (OPERATIONS // threads // 10), total
+    return elapsed
+
+
+def main():
+    """Runs the benchmarks."""
+    for threads in (1, 2, 4, 8, 16, 32):
+        elapsed = run(threads)
+        print('{:>2} threads: {:.4f}s  {:>9.0f} ops/s'.format(
+            threads, elapsed, OPERATIONS / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmarks comparing mostly equal dictionaries.
+
+Compares FlexDict.diff of two snapshots sharing their unchanged subtrees
+and of two separate copies against comparing their flattened items.
+
+Usage:
+    python -m benchmarks.diff
+"""
+
+from timeit import timeit
+
+from flexdict import FlexDict
+
+
+def tree(width, height):
+    """Builds a `width`-ary tree of `height`."""
+    flex = FlexDict()
+    for i in range(width ** height):
+        path = []
+        for _ in range(height):
+            i, rem = divmod(i, width)
+            path.append('key%d' % rem)
+        flex[path] = i
+    return flex
+
+
+def naive(first, second):
+    """Compares the flattened items of both dictionaries."""
+    first, second = dict(
+        (tuple(path), value) for path, value in first.flatten()
+    ), dict((tuple(path), value) for path, value in second.flatten())
+    return [
+        path for path in set(first) | set(second)
+        if first.get(path) != second.get(path)
+    ]
+
+
+def main():
+    """Runs the benchmarks."""
+    flex = tree(10, 5)
+    first = flex.freeze()
+    copy = FlexDict(flex)
+    for i in range(10):
+        flex['key%d' % i, 'key0', 'key0', 'key0', 'key0'] = -1
+    second = flex.freeze()
+    assert len(first.diff(second)) == len(naive(first, second)) == 10
+    naive_time = timeit(lambda: naive(first, second), number=5)
+    copy_time = timeit(lambda: copy.diff(flex), number=5)
+    shared_time = timeit(lambda: first.diff(second), number=5)
+    print('flatten: {:.4f}s  diff(copies): {:.4f}s  diff(snapshots): '
+          '{:.4f}s'.format(naive_time, copy_time, shared_time))
+
+
+if __name__ == '__main__':
+    main()
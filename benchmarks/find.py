@@ -0,0 +1,56 @@
+"""
+Benchmarks finding the key-paths of values.
+
+Compares FlexDict.find with and without an index created by create_index
+against filtering the flattened dictionary.
+
+Usage:
+    python -m benchmarks.find
+"""
+
+from timeit import timeit
+
+from flexdict import FlexDict
+
+
+def build(count):
+    """Builds `count` users spread over tenants."""
+    flex = FlexDict()
+    for i in range(count):
+        flex['tenant%d' % (i % 100), 'users', 'user%d' % i] = {
+            'user_id': i % 1000, 'name': 'user %d' % i,
+            'profile': {'age': i % 90, 'city': 'city%d' % (i % 50)},
+        }
+    return flex
+
+
+def scan(flex, value):
+    """Finds the user ids equal to `value` by flattening."""
+    return [
+        tuple(path) for path, other in flex.flatten()
+        if path[-1] == 'user_id' and other == value
+    ]
+
+
+def main():
+    """Runs the benchmarks."""
+    flex = build(200000)
+    expected = sorted(scan(flex, 7))
+    assert sorted(map(tuple, flex.find(key='user_id', value=7))) == expected
+    print('flatten + filter: {:.4f}s'.format(
+        timeit(lambda: scan(flex, 7), number=3)
+    ))
+    print('find, no index:   {:.4f}s'.format(
+        timeit(lambda: flex.find(key='user_id', value=7), number=3)
+    ))
+    print('create_index:     {:.4f}s'.format(
+        timeit(lambda: flex.create_index(key='user_id'), number=1)
+    ))
+    assert sorted(map(tuple, flex.find(key='user_id', value=7))) == expected
+    print('find, indexed:    {:.6f}s'.format(
+        timeit(lambda: flex.find(key='user_id', value=7), number=3)
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmarks loading JSON documents into FlexDicts.
+
+Compares the time and peak memory of json.load followed by FlexDict
+against FlexDict.load_stream, with and without a selection.
+
+Usage:
+    python -m benchmarks.load
+"""
+
+import io
+import json
+import tracemalloc
+from timeit import repeat
+
+from flexdict import FlexDict
+
+
+def document(count):
+    """Builds a JSON document with `count` records."""
+    return json.dumps({
+        'version': 1,
+        'records': {
+            'record%d' % i: {
+                'user': {'id': i, 'name': 'user%d' % i},
+                'metrics': {'score': i / 7.0, 'visits': i * 3},
+                'tags': ['a', 'b'],
+            }
+            for i in range(count)
+        },
+    })
+
+
+def measure(load, text):
+    """Gets the best time and the peak bytes allocated by `load`."""
+    elapsed = min(repeat(lambda: load(io.StringIO(text)), number=1, repeat=3))
+    fp = io.StringIO(text)
+    tracemalloc.start()
+    try:
+        load(fp)
+        return elapsed, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    """Runs the benchmarks."""
+    text = document(100000)
+    cases = [
+        ('json.load + FlexDict', lambda fp: FlexDict(json.load(fp))),
+        ('load_stream', FlexDict.load_stream),
+        (
+            'load_stream(select)',
+            lambda fp: FlexDict.load_stream(fp, select=['version'])
+        ),
+    ]
+    for name, load in cases:
+        elapsed, peak = measure(load, text)
+        print('{:<22} time: {:.4f}s  peak: {:>7.1f} MB'.format(
+            name, elapsed, peak / 1e6
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmarks opening a large FlexDict from disk.
+
+Compares loading the whole dictionary with FlexDict.from_bytes against
+opening it with MappedFlexDict, which only maps the file, and reading a
+few values from both.
+
+Usage:
+    python -m benchmarks.mapped
+"""
+
+import os
+from random import Random
+from tempfile import mkdtemp
+from timeit import timeit
+
+from flexdict import FlexDict, MappedFlexDict
+
+
+def documents(count):
+    """Builds `count` nested documents."""
+    flex = FlexDict()
+    for i in range(count):
+        flex['documents', 'doc%d' % i] = {
+            'meta': {'id': i, 'title': 'document %d' % i},
+            'stats': {'views': i * 3, 'score': i / 7.0},
+            'tags': ['a', 'b'],
+        }
+    return flex
+
+
+def main():
+    """Runs the benchmarks."""
+    count = 200000
+    flex = documents(count)
+    directory = mkdtemp()
+    binary, mapped = (os.path.join(directory, name)
+                      for name in ('data.bin', 'data.flex'))
+    with open(binary, 'wb') as fp:
+        fp.write(flex.to_bytes())
+    with open(mapped, 'wb') as fp:
+        flex.write_mapped(fp)
+    print('size      to_bytes: {:>10}  write_mapped: {:>10}'.format(
+        os.path.getsize(binary), os.path.getsize(mapped)
+    ))
+
+    def load():
+        with open(binary, 'rb') as fp:
+            return FlexDict.from_bytes(fp.read())
+
+    paths = [
+        ['documents', 'doc%d' % Random(0).randrange(count), 'stats', 'views']
+        for _ in range(1000)
+    ]
+    print('open      from_bytes: {:.4f}s  MappedFlexDict: {:.4f}s'.format(
+        timeit(load, number=3), timeit(
+            lambda: MappedFlexDict(mapped).close(), number=3
+        )
+    ))
+    loaded, opened = load(), MappedFlexDict(mapped)
+    assert [loaded[path] for path in paths] == [
+        opened[path] for path in paths
+    ]
+    print('1k gets   FlexDict: {:.4f}s  MappedFlexDict: {:.4f}s'.format(
+        timeit(lambda: [loaded[path] for path in paths], number=3),
+        timeit(lambda: [opened[path] for path in paths], number=3),
+    ))
+    opened.close()
+    for path in (binary, mapped):
+        os.remove(path)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmarks the memory used per nested dictionary.
+
+Reports the bytes allocated per node of FlexDict trees compared with
+the same data stored in plain nested dicts.
+
+Usage:
+    python -m benchmarks.memory
+"""
+
+import tracemalloc
+
+from flexdict import FlexDict
+
+
+def plain_tree(width, height, leaves):
+    """Builds nested dicts with `width` children on `height` levels."""
+    if not height:
+        return {'leaf%d' % i: i for i in range(leaves)}
+    return {
+        'node%d' % i: plain_tree(width, height - 1, leaves)
+        for i in range(width)
+    }
+
+
+def plain_copy(data):
+    """Copies nested dicts, reusing their keys and leaves."""
+    return {
+        key: plain_copy(value) if isinstance(value, dict) else value
+        for key, value in data.items()
+    }
+
+
+def measure(build):
+    """Gets the number of bytes allocated by `build`."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tree = build()
+        return tree, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def run(name, width, height, leaves):
+    """Prints the bytes per node of plain dicts, FlexDicts and snapshots."""
+    data = plain_tree(width, height, leaves)
+    nodes = sum(width ** level for level in range(height + 1))
+    _, plain_size = measure(lambda: plain_copy(data))
+    flex, flex_size = measure(lambda: FlexDict(data))
+    _, frozen_size = measure(flex.freeze)
+    print('{:<18} nodes: {:>7}  dict: {:>6.1f} B/node  '
+          'FlexDict: {:>6.1f} B/node  frozen: {:>6.1f} B/node'.format(
+              name, nodes, plain_size / nodes, flex_size / nodes,
+              frozen_size / nodes))
+
+
+def main():
+    """Runs the benchmarks."""
+    run('small(10^5, 2)', 10, 5, 2)
+    run('medium(20^3, 8)', 20, 3, 8)
+    run('wide(300^2, 1)', 300, 2, 1)
+
+
+if __name__ == '__main__':
+    main()
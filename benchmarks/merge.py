@@ -0,0 +1,54 @@
+"""
+Benchmarks merging layered configurations.
+
+Compares FlexDict.merge_many against flattening every layer and setting
+each of its items through __setitem__.
+
+Usage:
+    python -m benchmarks.merge
+"""
+
+from timeit import timeit
+
+from flexdict import FlexDict
+
+
+def layer(index, width, height):
+    """Builds a `width`-ary layer of `height` overriding a part of the base."""
+    flex = FlexDict()
+    for i in range(width ** height):
+        if index and i % 20 != index % 20:
+            continue
+        path = []
+        for _ in range(height):
+            i, rem = divmod(i, width)
+            path.append('key%d' % rem)
+        flex[path] = index
+    if index:
+        flex['layer%d' % index] = {'enabled': True}
+    return flex
+
+
+def naive(layers):
+    """Merges the layers one flattened item at a time."""
+    flex = FlexDict()
+    for other in layers:
+        for path, value in other.flatten():
+            flex[path] = value
+    return flex
+
+
+def main():
+    """Runs the benchmarks."""
+    for width, height in ((10, 5), (50, 3)):
+        layers = [layer(index, width, height) for index in range(20)]
+        naive_time = timeit(lambda: naive(layers), number=3)
+        copy_time = timeit(lambda: FlexDict().merge_many(layers), number=3)
+        print('{:<12} flatten+__setitem__: {:.4f}s  merge_many: {:.4f}s  '
+              'speedup: {:.2f}x'.format(
+                  '%d^%d' % (width, height), naive_time, copy_time,
+                  naive_time / copy_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmarks reading missing keys of a FlexDict.
+
+Checks many missing paths, which creates empty nested dictionaries unless
+probe mode is enabled, then times flattening the resulting dictionary and
+pruning the empty nested dictionaries.
+
+Usage:
+    python -m benchmarks.probe
+"""
+
+from time import time
+from timeit import timeit
+
+from flexdict import FlexDict
+
+
+def build():
+    """Builds a dictionary of users."""
+    return FlexDict({
+        'users': {
+            'user%d' % i: {'name': 'user %d' % i, 'age': i % 90}
+            for i in range(10000)
+        }
+    })
+
+
+def check(flex):
+    """Checks optional fields of every user and some missing users."""
+    for i in range(20000):
+        if flex['users', 'user%d' % i, 'address', 'city']:
+            raise ValueError('No user has an address!')
+
+
+def main():
+    """Runs the benchmarks."""
+    for probing in (False, True):
+        flex = build()
+        flex.probing = probing
+        print('probing={!s:<5}  checks: {:.4f}s  nodes: {:>6}  '
+              'flatten: {:.4f}s'.format(
+                  probing, timeit(lambda: check(flex), number=1),
+                  len(flex.keys(nested=True)),
+                  timeit(flex.flatten, number=3),
+              ))
+    flex = build()
+    check(flex)
+    start = time()
+    removed = flex.prune()
+    print('prune: {:.4f}s, removed {} nested dictionaries'.format(
+        time() - start, removed
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmarks matching key-path patterns.
+
+Compares FlexDict.query, with a pattern compiled once, against flattening
+the dictionary and matching every key-path with a regular expression.
+
+Usage:
+    python -m benchmarks.query
+"""
+
+import re
+from timeit import timeit
+
+from flexdict import FlexDict, Query
+
+PATTERN = ['services', '*', 'endpoints', '**', 'timeout']
+
+
+def config(count):
+    """Builds a configuration of `count` services."""
+    flex = FlexDict()
+    for i in range(count):
+        service = flex['services', 'service%d' % i]
+        service['replicas'] = i % 5
+        service['env'] = {'VAR%d' % j: str(j) for j in range(20)}
+        for j in range(5):
+            service['endpoints', 'route%d' % j] = {
+                'timeout': j, 'retries': {'count': 3, 'timeout': j * 2},
+            }
+    return flex
+
+
+def scan(flex, regex):
+    """Matches every flattened key-path with `regex`."""
+    return [
+        (path, value) for path, value in flex.flatten()
+        if regex.match('/'.join(path))
+    ]
+
+
+def main():
+    """Runs the benchmarks."""
+    flex = config(5000)
+    regex = re.compile(r'services/[^/]+/endpoints(/.+)?/timeout$')
+    query = Query(*PATTERN)
+    assert len(scan(flex, regex)) == len(flex.query(query))
+    print('flatten + regex:  {:.4f}s'.format(
+        timeit(lambda: scan(flex, regex), number=3)
+    ))
+    print('query:            {:.4f}s'.format(
+        timeit(lambda: flex.query(query), number=3)
+    ))
+    configs = [config(50) for _ in range(100)]
+    print('match_many x100:  {:.4f}s'.format(
+        timeit(lambda: query.match_many(configs), number=3)
+    ))
+
+
+if __name__ == '__main__':
+    main()
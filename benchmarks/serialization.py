@@ -0,0 +1,58 @@
+"""
+Benchmarks serializing FlexDicts.
+
+Compares the binary format of FlexDict.to_bytes, which pickling goes
+through, against copying the same data into nested plain dictionaries and
+pickling them.
+
+Usage:
+    python -m benchmarks.serialization
+"""
+
+import pickle
+from timeit import timeit
+
+from flexdict import FlexDict
+
+
+def records(count):
+    """Builds `count` records sharing the same keys."""
+    flex = FlexDict()
+    for i in range(count):
+        flex['records', i] = {
+            'user': {'id': i, 'name': 'user%d' % i, 'active': i % 2 == 0},
+            'metrics': {'score': i / 7.0, 'visits': i * 3},
+            'tags': ['a', 'b'],
+        }
+    return flex
+
+
+def plain(flex):
+    """Copies a FlexDict into nested plain dictionaries."""
+    return {
+        key: plain(value) if isinstance(value, dict) else value
+        for key, value in flex.items()
+    }
+
+
+def main():
+    """Runs the benchmarks."""
+    flex = records(50000)
+    data = plain(flex)
+    encoded, pickled = flex.to_bytes(), pickle.dumps(data, -1)
+    print('size       plain + pickle: {:>9}  to_bytes: {:>9}'.format(
+        len(pickled), len(encoded)
+    ))
+    print('encode     plain + pickle: {:.4f}s  to_bytes: {:.4f}s'.format(
+        timeit(lambda: pickle.dumps(plain(flex), -1), number=3),
+        timeit(flex.to_bytes, number=3),
+    ))
+    print('decode     pickle + FlexDict: {:.4f}s  from_bytes: '
+          '{:.4f}s'.format(
+              timeit(lambda: FlexDict(pickle.loads(pickled)), number=3),
+              timeit(lambda: FlexDict.from_bytes(encoded), number=3),
+          ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmarks the nested traversal methods on deep and wide trees.
+
+Compares the explicit-stack traversals of FlexDict against the previous
+recursive generator implementations.
+
+Usage:
+    python -m benchmarks.traversal
+"""
+
+from timeit import repeat
+
+from flexdict import FlexDict
+
+
+def recursive_kv(data, results=None):
+    """Previous recursive implementation of flatten."""
+    if results is None:
+        results = []
+    for key, value in data.items():
+        if isinstance(value, dict) and value:
+            for item in recursive_kv(value, results + [key]):
+                yield item
+        else:
+            yield results + [key], value
+
+
+def recursive_k(data):
+    """Previous recursive implementation of nested keys."""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            yield key
+            for nested_key in recursive_k(value):
+                yield nested_key
+        else:
+            yield key
+
+
+def recursive_v(data):
+    """Previous recursive implementation of nested values."""
+    for _, value in data.items():
+        if isinstance(value, dict) and value:
+            for nested_value in recursive_v(value):
+                yield nested_value
+        else:
+            yield value
+
+
+def deep_tree(depth, branches):
+    """Builds `branches` chains of `depth` levels each."""
+    flex = FlexDict()
+    for branch in range(branches):
+        flex[[branch] + ['level%d' % i for i in range(depth)]] = branch
+    return flex
+
+
+def wide_tree(width, height):
+    """Builds a tree with `width` children on each of `height` levels."""
+    flex = FlexDict()
+    for i in range(width ** height):
+        path = []
+        for _ in range(height):
+            i, rem = divmod(i, width)
+            path.append(rem)
+        flex[path] = i
+    return flex
+
+
+def run(name, flex, number):
+    """Prints the best timings of both implementations."""
+    cases = [
+        (
+            'flatten',
+            lambda: [(path, value) for path, value in recursive_kv(flex)],
+            flex.flatten
+        ),
+        (
+            'keys(nested)',
+            lambda: list(recursive_k(flex)),
+            lambda: flex.keys(nested=True)
+        ),
+        (
+            'values(nested)',
+            lambda: list(recursive_v(flex)),
+            lambda: flex.values(nested=True)
+        ),
+        (
+            'length(nested)',
+            lambda: len(list(recursive_k(flex))),
+            lambda: flex.length(nested=True)
+        ),
+    ]
+    for case, old, new in cases:
+        old_time = min(repeat(old, number=number, repeat=5))
+        new_time = min(repeat(new, number=number, repeat=5))
+        print('{:<12} {:<15} recursive: {:.4f}s  stack: {:.4f}s  '
+              'speedup: {:.2f}x'.format(
+                  name, case, old_time, new_time, old_time / new_time))
+
+
+def main():
+    """Runs the benchmarks."""
+    run('deep(40)', deep_tree(40, 500), 20)
+    run('deep(400)', deep_tree(400, 50), 20)
+    run('deep(4^8)', wide_tree(4, 8), 5)
+    run('wide(10^4)', wide_tree(10, 4), 20)
+    run('wide(40^3)', wide_tree(40, 3), 5)
+    run('wide(300^2)', wide_tree(300, 2), 5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmarks rebuilding FlexDicts from flattened items.
+
+Compares FlexDict.from_flat against assigning each item through
+__setitem__ in a loop.
+
+Usage:
+    python -m benchmarks.unflatten
+"""
+
+from random import Random
+from timeit import timeit
+
+from flexdict import FlexDict
+
+
+def items(width, height):
+    """Builds the flattened items of a `width`-ary tree of `height`."""
+    flex = FlexDict()
+    for i in range(width ** height):
+        path = []
+        for _ in range(height):
+            i, rem = divmod(i, width)
+            path.append('key%d' % rem)
+        flex[path] = i
+    return flex.flatten()
+
+
+def naive(rows):
+    """Rebuilds the dictionary one item at a time."""
+    flex = FlexDict()
+    for path, value in rows:
+        flex[path] = value
+    return flex
+
+
+def run(name, rows, number):
+    """Prints the timings of both approaches."""
+    naive_time = timeit(lambda: naive(rows), number=number)
+    bulk_time = timeit(lambda: FlexDict.from_flat(rows), number=number)
+    print('{:<22} __setitem__: {:.4f}s  from_flat: {:.4f}s  '
+          'speedup: {:.2f}x'.format(
+              name, naive_time, bulk_time, naive_time / bulk_time))
+
+
+def main():
+    """Runs the benchmarks."""
+    deep = items(4, 8)
+    shuffled = list(deep)
+    Random(0).shuffle(shuffled)
+    run('sorted(4^8)', deep, 5)
+    run('shuffled(4^8)', shuffled, 5)
+    run('sorted(40^3)', items(40, 3), 5)
+    dotted = [('.'.join(path), value) for path, value in deep]
+    naive_time = timeit(
+        lambda: naive([(path.split('.'), value) for path, value in dotted]),
+        number=5
+    )
+    bulk_time = timeit(
+        lambda: FlexDict.from_flat(dotted, sep='.'), number=5
+    )
+    print('{:<22} __setitem__: {:.4f}s  from_flat: {:.4f}s  '
+          'speedup: {:.2f}x'.format(
+              'dotted(4^8)', naive_time, bulk_time, naive_time / bulk_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,135 +6,3306 @@ levels of nesting along with additional utility
 methods.
 """
 
+# FlexDict ships as this single module, so it outgrows the line limit.
+# pylint: disable=C0302
+
+import csv
+import json
+import mmap
+import pickle  # nosec
+import struct
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import wraps
+from itertools import count, islice
+from multiprocessing import Pool
+from threading import Condition, Lock, current_thread
+from time import time
+from weakref import ref
+
 __version__ = '0.0.1.a1'
 
+_MISSING = object()
+
+
+class _Missing(object):
+    """Type of `MISSING`."""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'MISSING'
+
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__
+
+    def __reduce__(self):
+        return 'MISSING'
+
+    def __getitem__(self, key):
+        return self
+
+
+MISSING = _Missing()
+"""Marks a value missing from a dictionary, e.g. in the result of `diff`."""
+
+_STAMPS = count(1)
+
+
+def _numpy():
+    """Imports NumPy, which is an optional dependency."""
+    try:
+        import numpy  # pylint: disable=C0415
+    except ImportError:
+        numpy = None
+    if numpy is None:
+        raise ImportError(
+            'NumPy is required for columnar conversions: '
+            'pip install flexdict[numpy]'
+        )
+    return numpy
+
+
+_DTYPES = {bool: 'bool', int: 'int64', float: 'float64'}
+
+_TEXT = (str, type(u''))
+
+_MAGIC = b'FLEX\x02'
+
+_LOCKED = 1
+
+_MAPPED = b'FLEXMAP\x01'
+
+_COUNT = struct.Struct('<I')
+
+_ENTRY = struct.Struct('<IQ')
+
+_SLOT = struct.Struct('<II')
+
+_TRAILER = struct.Struct('<BQQ')
+
+
+def _intern(keys, typed, table, key):
+    """
+    Adds `key` to the key table of `_encode` unless it is already there.
+    Equal keys of different types, like `1` and `True`, are kept apart.
+    """
+    index = typed.get((type(key), key))
+    if index is None:
+        index = typed[type(key), key] = len(table)
+        table.append(key)
+        keys.setdefault(key, index)
+    return index
+
+
+def _parts(data):
+    """
+    Encodes nested dictionaries depth-first, into a table of their distinct
+    keys, a shape, a list of their values and their lock states.
+
+    Every item is written into the shape as the table index of its key,
+    doubled, plus one if the value is a dictionary. Nested dictionaries are
+    followed by their number of items and written in place, other values
+    go into the list of values. Dictionaries are numbered in the order they
+    are written, from 0 for `data` on; the lock states are `(number, state)`
+    pairs of the ones locked differently from their parent.
+    """
+    # Lock states are read from the contexts of the encoded nodes.
+    # pylint: disable=W0212
+    keys, typed, table, shape, values, locks = {}, {}, [], [len(data)], [], []
+    push = shape.append
+    ctx = data._ctx if isinstance(data, FlexDict) else None
+    state = ctx is not None and ctx.locked
+    if state:
+        locks.append((0, state))
+    stack = [(iter(data.items()), ctx, state, id(data))]
+    ancestors, number = {id(data)}, 0
+    enter, leave = ancestors.add, ancestors.discard
+    while stack:
+        items, ctx, state, _ = stack[-1]
+        for key, value in items:
+            index = keys.get(key)
+            if index is None or type(table[index]) is not type(key):
+                index = _intern(keys, typed, table, key)
+            if isinstance(value, dict):
+                push(index * 2 + 1)
+                push(len(value))
+                number += 1
+                if isinstance(value, FlexDict) and value._ctx is not ctx:
+                    ctx = value._ctx
+                    if ctx.locked != state:
+                        state = not state
+                        locks.append((number, state))
+                ident = id(value)
+                if ident in ancestors:
+                    raise ValueError('Dictionaries cannot contain themselves!')
+                enter(ident)
+                stack.append((iter(value.items()), ctx, state, ident))
+                break
+            push(index * 2)
+            values.append(value)
+        else:
+            leave(stack.pop()[3])
+    return table, shape, values, locks
+
+
+def _encode(data):
+    """Pickles the parts of nested dictionaries after the magic bytes."""
+    return _MAGIC + pickle.dumps(_parts(data), pickle.HIGHEST_PROTOCOL)
+
+
+def _node_block(entries):
+    """
+    Packs the entries of a node written by `_write_mapped`: their number,
+    the entries in insertion order and their positions sorted by key.
+    """
+    slots = sorted((tag >> 1, i) for i, (tag, _) in enumerate(entries))
+    return b''.join(
+        [_COUNT.pack(len(entries))]
+        + [_ENTRY.pack(tag, offset) for tag, offset in entries]
+        + [_SLOT.pack(index, i) for index, i in slots]
+    )
+
+
+def _write_mapped(data, fp, locked):
+    """
+    Writes nested dictionaries into the file layout of `MappedFlexDict`.
+
+    Values are pickled one by one, with protocol 2 which does not frame
+    them, and nodes are written after their children, so every entry points
+    to the offset of its value or node.
+    Entries are tagged like the shape of `_encode`: the table index of
+    their key, doubled, plus one if they point to a node. The key table
+    and a trailer locating it and the root node come last.
+    """
+    keys, typed, table = {}, {}, []
+    fp.write(_MAPPED)
+    position = len(_MAPPED)
+    stack = [(iter(data.items()), [], None)]
+    while True:
+        items, entries, tag = stack[-1]
+        for key, value in items:
+            index = keys.get(key)
+            if index is None or type(table[index]) is not type(key):
+                index = _intern(keys, typed, table, key)
+            if isinstance(value, dict):
+                stack.append((iter(value.items()), [], index * 2 + 1))
+                break
+            blob = pickle.dumps(value, 2)
+            fp.write(_COUNT.pack(len(blob)))
+            fp.write(blob)
+            entries.append((index * 2, position))
+            position += _COUNT.size + len(blob)
+        else:
+            stack.pop()
+            block = _node_block(entries)
+            fp.write(block)
+            if not stack:
+                break
+            stack[-1][1].append((tag, position))
+            position += len(block)
+    fp.write(pickle.dumps(table, pickle.HIGHEST_PROTOCOL))
+    fp.write(_TRAILER.pack(
+        _LOCKED if locked else 0, position + len(block), position
+    ))
+
+
+class _Context(object):
+    """
+    State shared by the nodes of a FlexDict tree.
+
+    Every nested `FlexDict` points to the context of the tree it belongs to.
+    A subtree gets a context of its own, chained to the one of its parent,
+    once it needs state of its own (such as a lock or an index).
+
+    Lock states are stamped when set. The most recently set state along the
+    chain wins, so locking a tree overrides the states of its subtrees while
+    the subtrees can still be (un)locked on their own afterwards.
+
+    The probe mode set closest along the chain wins. The thread locks of a
+    `ConcurrentFlexDict` are shared by the whole chain.
+    """
+
+    __slots__ = (
+        'owner', 'parent', 'tracker', 'state', 'stamp', 'snapshot', 'guard',
+        'probe'
+    )
+
+    def __init__(self, owner, parent=None):
+        self.owner = ref(owner)
+        self.parent = parent
+        self.tracker = None
+        self.snapshot = None
+        self.guard = None if parent is None else parent.guard
+        self.probe = False if parent is None else None
+        self.state, self.stamp = (False, 0) if parent is None else (None, -1)
+
+    @property
+    def locked(self):
+        """Gets the lock state in effect for the context."""
+        ctx, state, stamp = self.parent, self.state, self.stamp
+        while ctx is not None:
+            if ctx.stamp > stamp:
+                state, stamp = ctx.state, ctx.stamp
+            ctx = ctx.parent
+        return state
+
+    def set_lock(self, state):
+        """Sets the lock state of the context."""
+        self.state, self.stamp = state, next(_STAMPS)
+
+    @property
+    def probing(self):
+        """Gets the probe mode in effect for the context."""
+        ctx = self
+        while ctx.probe is None:
+            ctx = ctx.parent
+        return ctx.probe
+
+
+class _Tracker(object):
+    """
+    Keeps the key-paths of the nodes inside a tracked subtree and feeds
+    every mutation made through FlexDict methods to its observers.
+
+    Observers implement `add(node, path, key, value)` and
+    `discard(node, path, key, value)`, which are called for every item
+    entering or leaving the subtree, nested items included. The journal,
+    if any, records every mutation once, as it is made.
+    """
+
+    __slots__ = ('paths', 'observers', 'journal')
+
+    def __init__(self, root):
+        self.paths = {}
+        self.observers = {}
+        self.journal = None
+        self.__visit(root, (), True, None)
+
+    @property
+    def idle(self):
+        """Tells if the tracker has nothing left to feed."""
+        return not self.observers and self.journal is None
+
+    def __visit(self, node, path, add, observers):
+        stack = [(node, path)]
+        if add:
+            self.paths[id(node)] = path
+        else:
+            self.paths.pop(id(node), None)
+        while stack:
+            node, path = stack.pop()
+            for key, value in node.items():
+                self.__item((node, path, key, value), add, observers)
+                if isinstance(value, FlexDict):
+                    child = path + (key,)
+                    if add:
+                        self.paths[id(value)] = child
+                    else:
+                        self.paths.pop(id(value), None)
+                    stack.append((value, child))
+
+    def __item(self, item, add, observers):
+        for observer in observers or self.observers.values():
+            if add:
+                observer.add(*item)
+            else:
+                observer.discard(*item)
+
+    def observe(self, name, observer, root):
+        """Registers and feeds an observer with the current items."""
+        self.observers[name] = observer
+        self.__visit(root, (), True, [observer])
+
+    def update(self, node, key, old, new):
+        """Propagates the replacement of `old` with `new` under `key`."""
+        path = self.paths.get(id(node))
+        if path is None:
+            return
+        if self.journal is not None:
+            self.journal.record(path + (key,), old, new)
+        for value, add in ((old, False), (new, True)):
+            if value is _MISSING:
+                continue
+            self.__item((node, path, key, value), add, None)
+            if isinstance(value, FlexDict):
+                self.__visit(value, path + (key,), add, None)
+
+
+class _SubsetIndex(object):
+    """
+    Maps keys and `(key, leaf-value)` pairs to the nodes holding them.
+    """
+
+    __slots__ = ('keys', 'items')
+
+    def __init__(self):
+        self.keys = {}
+        self.items = {}
+
+    def __buckets(self, key, value):
+        buckets = [(self.keys, key)]
+        if not isinstance(value, dict):
+            try:
+                hash(value)
+            except TypeError:
+                return buckets
+            buckets.append((self.items, (key, value)))
+        return buckets
+
+    def add(self, node, path, key, value):  # pylint: disable=W0613
+        """Indexes an item of a node."""
+        for index, bucket in self.__buckets(key, value):
+            index.setdefault(bucket, {})[id(node)] = node
+
+    def discard(self, node, path, key, value):  # pylint: disable=W0613
+        """Removes an item of a node from the index."""
+        for index, bucket in self.__buckets(key, value):
+            nodes = index.get(bucket)
+            if nodes is not None:
+                nodes.pop(id(node), None)
+                if not nodes:
+                    del index[bucket]
+
+    def candidates(self, subset):
+        """Gets the smallest group of nodes that may contain `subset`."""
+        best = None
+        for key, value in subset.items():
+            index, bucket = self.__buckets(key, value)[-1]
+            nodes = index.get(bucket)
+            if not nodes:
+                return []
+            if best is None or len(nodes) < len(best):
+                best = nodes
+        return list(best.values())
+
+
+class _ValueIndex(object):
+    """
+    Maps the values under a key, or at the key-paths matching a pattern
+    where `'*'` stands for any key, to their key-paths.
+
+    Values which are dictionaries or unhashable are only mapped from their
+    key-paths, and compared one by one when looked up.
+    """
+
+    __slots__ = ('key', 'pattern', 'name', 'paths', 'values')
+
+    def __init__(self, key, pattern):
+        self.key, self.pattern = key, pattern
+        self.name = ('key', key) if pattern is None else ('path', pattern)
+        self.paths = {}
+        self.values = {}
+
+    @staticmethod
+    def __hashable(value):
+        if isinstance(value, dict):
+            return False
+        try:
+            hash(value)
+        except TypeError:
+            return False
+        return True
+
+    def __matches(self, path, key):
+        pattern = self.pattern
+        if pattern is None:
+            return key == self.key
+        if len(pattern) != len(path) + 1 or pattern[-1] not in ('*', key):
+            return False
+        return all(
+            expected == '*' or expected == actual
+            for expected, actual in zip(pattern, path)
+        )
+
+    def add(self, node, path, key, value):  # pylint: disable=W0613
+        """Indexes an item if it matches the key or pattern."""
+        if not self.__matches(path, key):
+            return
+        path += (key,)
+        self.paths[path] = value
+        if self.__hashable(value):
+            self.values.setdefault(value, {})[path] = None
+
+    def discard(self, node, path, key, value):  # pylint: disable=W0613
+        """Removes an item from the index."""
+        if not self.__matches(path, key):
+            return
+        path += (key,)
+        self.paths.pop(path, None)
+        if self.__hashable(value):
+            paths = self.values.get(value)
+            if paths is not None:
+                paths.pop(path, None)
+                if not paths:
+                    del self.values[value]
+
+    def find(self, value=MISSING):
+        """Gets the key-paths of the indexed values equal to `value`."""
+        if value is MISSING:
+            paths = self.paths
+        elif self.__hashable(value):
+            paths = self.values.get(value, ())
+        else:
+            paths = [
+                path for path, other in self.paths.items()
+                if other is value or other == value
+            ]
+        return [tuple.__new__(KeyPath, path) for path in paths]
+
+
+class _Journal(object):
+    """
+    Bounded log of the mutations made to a tracked subtree.
+
+    Records are `(sequence, path, old, new)` tuples numbered from 1 on.
+    Nested dictionaries are recorded as copies, so later mutations do not
+    alter them. The oldest records are discarded once `maxlen` is reached.
+    """
+
+    __slots__ = ('records', 'sequence')
+
+    def __init__(self, maxlen):
+        self.records = deque(maxlen=maxlen)
+        self.sequence = count(1)
+
+    def record(self, path, old, new):
+        """Appends a mutation of the value at `path`."""
+        self.records.append((
+            next(self.sequence), tuple.__new__(KeyPath, path),
+            self.__copy(old), self.__copy(new),
+        ))
+
+    @staticmethod
+    def __copy(value):
+        if value is _MISSING:
+            return MISSING
+        return FlexDict(value) if isinstance(value, dict) else value
+
+    def since(self, sequence):
+        """Gets the records following the `sequence` number."""
+        records = self.records
+        if records and records[0][0] > sequence + 1:
+            raise ValueError(
+                'Changes since {} are no longer in the journal!'.format(
+                    sequence
+                )
+            )
+        start = max(len(records) - (
+            records[-1][0] - sequence if records else 0
+        ), 0)
+        return [records[i] for i in range(start, len(records))]
+
+
+class _Cache(object):
+    """
+    Leaves of a CachedFlexDict, from the least to the most recently used
+    and in the order they expire, along with their total weight and the
+    hit, miss and eviction counters.
+
+    Leaves are identified by their node and key. They all live for `ttl`
+    seconds, so the order they are set in is the order they expire in.
+    """
+
+    __slots__ = ('maxsize', 'ttl', 'weigh', 'timer', 'recency', 'expiry',
+                 'weight', 'hits', 'misses', 'evictions')
+
+    def __init__(self, maxsize, ttl, weigh, timer):
+        self.maxsize, self.ttl, self.weigh, self.timer = (
+            maxsize, ttl, weigh, timer
+        )
+        self.recency = OrderedDict()
+        self.expiry = OrderedDict()
+        self.weight = self.hits = self.misses = self.evictions = 0
+
+    def add(self, node, path, key, value):  # pylint: disable=W0613
+        """Adds a leaf as the most recently used one."""
+        if isinstance(value, dict):
+            return
+        weight = 1 if self.weigh is None else self.weigh(value)
+        self.recency[id(node), key] = node, key, weight
+        self.weight += weight
+        if self.ttl is not None:
+            self.expiry[id(node), key] = self.timer() + self.ttl
+
+    def discard(self, node, path, key, value):  # pylint: disable=W0613
+        """Forgets a leaf."""
+        if isinstance(value, dict):
+            return
+        entry = self.recency.pop((id(node), key), None)
+        if entry is not None:
+            self.weight -= entry[2]
+            self.expiry.pop((id(node), key), None)
+
+    def touch(self, node, key):
+        """
+        Marks a leaf as the most recently used one. Returns `False` if the
+        leaf has expired instead.
+        """
+        slot = id(node), key
+        expires = self.expiry.get(slot)
+        if expires is not None and expires <= self.timer():
+            return False
+        entry = self.recency.pop(slot, None)
+        if entry is not None:
+            self.recency[slot] = entry
+        return True
+
+    def victim(self):
+        """Gets the node and key of the next leaf to evict, if any."""
+        if self.expiry:
+            slot = next(iter(self.expiry))
+            if self.expiry[slot] <= self.timer():
+                return self.recency[slot][:2]
+        if self.maxsize is not None and self.weight > self.maxsize:
+            return self.recency[next(iter(self.recency))][:2]
+        return None
+
+
+class _Guard(object):
+    """
+    Thread locks of a ConcurrentFlexDict tree.
+
+    Mutations of single values run concurrently, each holding the stripe
+    lock of its target. Exclusive operations wait for the ongoing mutations
+    to finish and hold off the new ones until they are done. Mutations of
+    tracked trees share a single lock since observers are not thread-safe.
+    """
+
+    __slots__ = ('stripes', 'serial', 'condition', 'owner', 'active',
+                 'waiting')
+
+    def __init__(self, stripes):
+        self.stripes = [Lock() for _ in range(stripes)]
+        self.serial = Lock()
+        self.condition = Condition(Lock())
+        self.owner = None
+        self.active = 0
+        self.waiting = 0
+
+    def stripe(self, node, key):
+        """Gets the lock guarding the value of `node` under `key`."""
+        # The guard is shared by the nodes it guards.
+        # pylint: disable=W0212
+        ctx = node._ctx if isinstance(node, FlexDict) else None
+        while ctx is not None:
+            if ctx.tracker is not None:
+                return self.serial
+            ctx = ctx.parent
+        return self.stripes[hash((id(node), key)) % len(self.stripes)]
+
+    @contextmanager
+    def mutating(self):
+        """Runs a mutation, unless an exclusive operation is running."""
+        if self.owner is current_thread():
+            yield
+            return
+        with self.condition:
+            while self.owner is not None or self.waiting:
+                self.condition.wait()
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                if not self.active:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        """Runs an operation while no other thread mutates the tree."""
+        thread = current_thread()
+        if self.owner is thread:
+            yield
+            return
+        with self.condition:
+            self.waiting += 1
+            while self.owner is not None or self.active:
+                self.condition.wait()
+            self.waiting -= 1
+            self.owner = thread
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.owner = None
+                self.condition.notify_all()
+
+
+class _Pairs(list):
+    """Key-value pairs of a parsed JSON object."""
+
+    __slots__ = ()
+
+
+class KeyPath(tuple):
+    """
+    Pre-validated and hashable key-path of a FlexDict.
+
+    Lookups with a `KeyPath` skip key sanitization and resolve the path
+    in a single loop, which makes it cheap to reuse across many lookups.
+
+    Args:
+        *keys: Keys of the path.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, *keys):
+        for key in keys:
+            if isinstance(key, dict):
+                raise TypeError('unhashable type: \'dict\'')
+            hash(key)
+        return super(KeyPath, cls).__new__(cls, keys)
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    def __repr__(self):
+        return 'KeyPath({})'.format(', '.join(repr(key) for key in self))
+
+
+class Query(object):
+    """
+    Compiled key-path pattern, where `'*'` stands for any key and `'**'`
+    for any number of keys, none included.
+
+    The pattern is compiled into an automaton whose states are built as
+    they are first reached and kept for later matches, so a query is cheap
+    to reuse across many dictionaries. Matching descends only into the
+    nested dictionaries which can still match and looks literal keys up
+    directly instead of iterating over the items.
+
+    Args:
+        *keys: Keys of the pattern.
+    """
+
+    __slots__ = ('keys', '__states', '__start')
+
+    def __init__(self, *keys):
+        self.keys = KeyPath(*keys)
+        self.__states = {}
+        self.__start = self.__closure([0])
+
+    def __repr__(self):
+        return 'Query({})'.format(', '.join(repr(key) for key in self.keys))
+
+    def __wild(self, position):
+        return position < len(self.keys) and self.keys[position] in (
+            '*', '**'
+        )
+
+    def __closure(self, positions):
+        """Adds the positions reached by matching `'**'` with no keys."""
+        keys, closed = self.keys, set()
+        while positions:
+            position = positions.pop()
+            if position not in closed:
+                closed.add(position)
+                if position < len(keys) and keys[position] == '**':
+                    positions.append(position + 1)
+        return frozenset(closed)
+
+    def __step(self, positions, key):
+        """Gets the positions reached by matching `key` at `positions`."""
+        keys, reached = self.keys, []
+        for position in positions:
+            if position == len(keys):
+                continue
+            if keys[position] == '**':
+                reached.append(position)
+            elif keys[position] == '*' or keys[position] == key:
+                reached.append(position + 1)
+        return self.__closure(reached)
+
+    def __state(self, positions):
+        """
+        Gets the state of the automaton at `positions` as a tuple of: the
+        positions reached by each literal key, the ones reached by any
+        other key, whether the pattern is matched, whether the items have
+        to be iterated over and whether the pattern can still be matched
+        deeper.
+        """
+        state = self.__states.get(positions)
+        if state is None:
+            keys, end = self.keys, len(self.keys)
+            moves = {
+                keys[position]: None for position in positions
+                if position < end and not self.__wild(position)
+            }
+            for key in moves:
+                moves[key] = self.__step(positions, key)
+            state = self.__states[positions] = (
+                moves, self.__step(positions, _MISSING), end in positions,
+                any(self.__wild(position) for position in positions),
+                any(position < end for position in positions),
+            )
+        return state
+
+    @staticmethod
+    def __items(node, state):
+        if state[3]:
+            return iter(node.items())
+        return (
+            (key, dict.get(node, key)) for key in state[0]
+            if dict.__contains__(node, key)
+        )
+
+    def match(self, data):
+        """
+        Gets the items of a (nested) dictionary at the key-paths matching
+        the pattern.
+
+        Args:
+            data (dict): Dictionary to match.
+
+        Returns:
+            list: `(KeyPath, value)` pairs of the items, depth-first.
+        """
+        results, states = [], self.__states
+        start = self.__state(self.__start)
+        stack = [((), self.__items(data, start), start)]
+        while stack:
+            path, items, state = stack[-1]
+            moves, other = state[0], state[1]
+            for key, value in items:
+                positions = moves.get(key, other)
+                if not positions:
+                    continue
+                child = states.get(positions) or self.__state(positions)
+                if child[2]:
+                    results.append(
+                        (tuple.__new__(KeyPath, path + (key,)), value)
+                    )
+                if child[4] and isinstance(value, dict):
+                    stack.append((
+                        path + (key,), self.__items(value, child), child
+                    ))
+                    break
+            else:
+                stack.pop()
+        return results
+
+    def match_many(self, data):
+        """
+        Gets the matching items of many dictionaries at once, reusing the
+        states of the automaton across them.
+
+        Args:
+            data (iterable): Dictionaries to match.
+
+        Returns:
+            list: The result of `match` for each dictionary.
+        """
+        return [self.match(item) for item in data]
+
+
+def _sanitize(key):
+    """Turns collections of keys into key-paths (lists or `KeyPath`s)."""
+    if isinstance(key, KeyPath):
+        return key
+    if isinstance(key, (list, set, tuple)):
+        return list(key)
+    if isinstance(key, dict):
+        raise TypeError('unhashable type: \'dict\'')
+    return key
+
+
+def _as_path(keys):
+    """Turns key(s) into a key-path tuple (or `KeyPath`)."""
+    keys = _sanitize(keys)
+    if isinstance(keys, KeyPath):
+        return keys
+    if isinstance(keys, list):
+        return tuple(keys)
+    return (keys,)
+
+
+# The public methods are the dict API plus the utilities built on it.
+class FlexDict(dict):  # pylint: disable=R0904
+    """
+    Provides automatic and arbitrary levels of
+    nesting along with additional utility methods.
+
+    Args:
+        data (dict): Data to initialize the FlexDict with.
+
+    Attributes:
+        locked (bool):
+            Flag indicating if auto-nesting is locked. Setting it is the
+            same as calling `lock` or `unlock`.
+        probing (bool):
+            Flag indicating if reading a missing key gets `MISSING`, which
+            can be indexed further, instead of creating a nested dictionary
+            (or raising a `KeyError` if locked). Writes still create nested
+            dictionaries.
+    """
+
+    # Nodes of a tree share their context and call each other's private
+    # helpers, which pylint reports as access from a client class.
+    # pylint: disable=W0212
+
+    __slots__ = ('_ctx', '__weakref__')
+
+    def __init__(self, data=None):
+        super(FlexDict, self).__init__()
+        self._ctx = _Context(self)
+        if data:
+            if isinstance(data, dict):
+                self.__build(data, copy=True)
+            else:
+                raise ValueError(
+                    'FlexDict can only be initialized with instances of dict!'
+                )
+
+    def __hash__(self):
+        return id(self)
+
+    @property
+    def locked(self):
+        """Whether missing keys raise `KeyError` instead of being created."""
+        return self._ctx.locked
+
+    @locked.setter
+    def locked(self, value):
+        self.__lock(bool(value), inplace=True)
+
+    @property
+    def probing(self):
+        """Whether missing keys get `MISSING` instead of being created."""
+        return self._ctx.probing
+
+    @probing.setter
+    def probing(self, value):
+        self.__own_context().probe = bool(value)
+
+    def __reduce__(self):
+        return _restore, (self.__class__,), _parts(self)
+
+    def __setstate__(self, state):
+        self.__decode(*state)
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            return self.__equals(self, other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __getitem__(self, key):
+        key = self.__sanitize(key)
+        if isinstance(key, (list, KeyPath)):
+            return self.__resolve(key, len(key), probe=True)
+        return self.__child(key, probe=True)
+
+    def __setitem__(self, key, val):
+        key = self.__sanitize(key)
+        if isinstance(key, (list, KeyPath)):
+            self.__resolve(key, len(key) - 1)[key[-1]] = val
+        else:
+            self.__assign(key, val)
+
+    def __assign(self, key, val):
+        if isinstance(val, dict):
+            val = self.__node().__build(val, copy=True)
+        self.__store(key, val)
+
+    def __delitem__(self, key):
+        key = self.__sanitize(key)
+        if isinstance(key, (list, KeyPath)):
+            node, get = self, dict.__getitem__
+            for i in range(len(key) - 1):
+                node = get(node, key[i]) if isinstance(node, dict) else node[
+                    key[i]
+                ]
+            del node[key[-1]]
+        else:
+            self.__remove(key)
+
+    def __remove(self, key):
+        if not self.__tracked():
+            dict.__delitem__(self, key)
+            return
+        old = dict.__getitem__(self, key)
+        dict.__delitem__(self, key)
+        self.__notify(key, old, _MISSING)
+
+    def __child(self, key, probe=False):
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            if probe and self._ctx.probing:
+                return MISSING
+            if not self.locked:
+                node = self.__node()
+                self.__store(key, node)
+                return node
+            raise
+
+    # Used by the subclasses to update nodes other than `self`.
+    _remove, _child = __remove, __child
+
+    def __resolve(self, keys, stop, probe=False):
+        """Resolves `keys[:stop]` in a single loop."""
+        node, get = self, dict.get
+        for i in range(stop):
+            key = keys[i]
+            if isinstance(node, FlexDict):
+                child = get(node, key, _MISSING)
+                node = node.__child(key, probe) if (
+                    child is _MISSING
+                ) else child
+            else:
+                node = node[key]
+        return node
+
+    def __node(self):
+        cls = FlexDict if isinstance(self, FrozenFlexDict) else type(self)
+        node = cls.__new__(cls)
+        node._ctx = self._ctx
+        return node
+
+    def __tracked(self):
+        ctx = self._ctx
+        return ctx.tracker is not None or ctx.parent is not None
+
+    def __store(self, key, value):
+        if not self.__tracked():
+            dict.__setitem__(self, key, value)
+            return
+        old = dict.get(self, key, _MISSING)
+        dict.__setitem__(self, key, value)
+        self.__notify(key, old, value)
+
+    def __notify(self, key, old, new):
+        ctx = self._ctx
+        while ctx is not None:
+            if ctx.tracker is not None:
+                ctx.tracker.update(self, key, old, new)
+            ctx = ctx.parent
+
+    def __nodes(self):
+        yield self
+        for _, _, value, _ in self.__walk(self):
+            if isinstance(value, FlexDict):
+                yield value
+
+    def __adopt(self, ctx):
+        """Moves `self` and its nested nodes into the context `ctx`."""
+        old = self._ctx
+        for node in self.__nodes():
+            if node._ctx is old:
+                node._ctx = ctx
+            elif node._ctx.parent is old:
+                node._ctx.parent = ctx
+
+    def __own_context(self):
+        """Gets a context owned by `self`, detaching it if shared."""
+        ctx = self._ctx
+        if ctx.owner() is not self:
+            self.__adopt(_Context(self, parent=ctx))
+        return self._ctx
+
+    def __tracker(self):
+        ctx = self._ctx
+        if ctx.tracker is not None and ctx.owner() is self:
+            return ctx.tracker
+        return None
+
+    def __index(self):  # pylint: disable=W0238
+        tracker = self.__tracker()
+        return None if tracker is None else tracker.observers.get('subset')
+
+    __sanitize = staticmethod(_sanitize)
+
+    @staticmethod
+    def __walk(data, leaves=False):
+        """
+        Traverses nested dictionaries depth-first with an explicit stack.
+
+        Yields `(path, key, value, branch)` tuples where `path` is the
+        key-path of the parent and `branch` tells if `value` is a non-empty
+        dictionary which is visited next. Branches are not yielded if
+        `leaves` is `True`. `path` is a single list shared by the whole
+        traversal; copy it if it needs to outlive the next iteration.
+        """
+        path = []
+        stack = [iter(data.items())]
+        push, pop = stack.append, stack.pop
+        while stack:
+            for key, value in stack[-1]:
+                if isinstance(value, dict) and value:
+                    if not leaves:
+                        yield path, key, value, True
+                    path.append(key)
+                    push(iter(value.items()))
+                    break
+                yield path, key, value, False
+            else:
+                pop()
+                if path:
+                    path.pop()
+
+    @staticmethod
+    def __keys(data, add):
+        """
+        Passes every nested key to `add` in the order `__walk` yields them.
+        """
+        stack = [iter(data.items())]
+        push, pop = stack.append, stack.pop
+        while stack:
+            for key, value in stack[-1]:
+                add(key)
+                if isinstance(value, dict) and value:
+                    push(iter(value.items()))
+                    break
+            else:
+                pop()
+
+    @staticmethod
+    def __leaves(data, add):
+        """
+        Passes every leaf value to `add` in the order `__walk` yields them.
+
+        Chains of single-child dictionaries are followed in place instead of
+        pushing an iterator for each of their levels.
+        """
+        stack = [iter(data.values())]
+        push, pop = stack.append, stack.pop
+        while stack:
+            for value in stack[-1]:
+                if isinstance(value, dict) and value:
+                    while len(value) == 1:
+                        child, = value.values()
+                        if not (isinstance(child, dict) and child):
+                            break
+                        value = child
+                    push(iter(value.values()))
+                    break
+                add(value)
+            else:
+                pop()
+
+    @staticmethod
+    def __count(data):
+        """Counts the nested keys without visiting them one by one."""
+        total = 0
+        stack = [data]
+        push, pop = stack.append, stack.pop
+        while stack:
+            node = pop()
+            total += len(node)
+            for value in node.values():
+                if isinstance(value, dict):
+                    push(value)
+        return total
+
+    @staticmethod
+    def __equals(first, second):
+        """
+        Compares nested dictionaries structurally, ignoring the key order.
+
+        Stops at the first mismatch. Sizes and cached hashes of frozen
+        subtrees are compared before descending and identical subtrees are
+        skipped.
+        """
+        stack = [(first, second)]
+        push, pop = stack.append, stack.pop
+        while stack:
+            first, second = pop()
+            if first is second:
+                continue
+            if len(first) != len(second):
+                return False
+            digests = getattr(first, '_hash', None), getattr(
+                second, '_hash', None
+            )
+            if None not in digests and digests[0] != digests[1]:
+                return False
+            for key, value in first.items():
+                other = dict.get(second, key, _MISSING)
+                if isinstance(value, dict):
+                    if not isinstance(other, dict):
+                        return False
+                    push((value, other))
+                elif other is _MISSING or not (
+                        value is other or value == other
+                ):
+                    return False
+        return True
+
+    def __build(self, data, copy):
+        """
+        Fills `self` with nested dictionaries in a single structural pass.
+
+        Every nested dictionary is converted into a `FlexDict` exactly once.
+        Nested `FlexDict` instances are taken over as they are unless `copy`
+        is `True`. Returns `self`.
+        """
+        stack = [(self, data)]
+        push, pop = stack.append, stack.pop
+        while stack:
+            node, source = pop()
+            for key, value in source.items():
+                if isinstance(value, dict):
+                    if copy or type(value) is not type(self):
+                        child = self.__node()
+                        push((child, value))
+                        value = child
+                    else:
+                        value.__adopt(self._ctx)
+                dict.__setitem__(node, key, value)
+        return self
+
+    def __lock(self, lock, inplace):
+        data = self if inplace else type(self)(self)
+        data.__own_context().set_lock(lock)
+        return None if inplace else data
+
+    @staticmethod
+    def __contains(superset, subset):
+        if superset == subset:
+            return True
+        if not subset:
+            return False
+        index = superset.__index() if isinstance(
+            superset, FlexDict
+        ) else None
+        if index is not None:
+            nodes = index.candidates(subset)
+        else:
+            nodes = FlexDict.__branches(superset)
+        return any(FlexDict.__holds(node, subset) for node in nodes)
+
+    @staticmethod
+    def __branches(data):
+        yield data
+        for _, _, value, branch in FlexDict.__walk(data):
+            if branch:
+                yield value
+
+    @staticmethod
+    def __holds(node, subset):
+        for key, value in subset.items():
+            other = dict.get(node, key, _MISSING)
+            if other is _MISSING or not (other is value or other == value):
+                return False
+        return True
+
+    @staticmethod
+    def path(*keys):
+        """
+        Compiles a reusable key-path.
+
+        Args:
+            *keys: Keys of the path.
+
+        Returns:
+            KeyPath: Path which can be used in place of a list of keys.
+        """
+        return KeyPath(*keys)
+
+    @staticmethod
+    def compile_query(*keys):
+        """
+        Compiles a reusable key-path pattern for `query`.
+
+        Args:
+            *keys:
+                Keys of the pattern, where `'*'` stands for any key and
+                `'**'` for any number of keys, none included.
+
+        Returns:
+            Query: Pattern which can be matched against many dictionaries.
+        """
+        return Query(*keys)
+
+    @classmethod
+    def from_dict(cls, data, copy=True):
+        """
+        Creates a FlexDict from a nested dictionary in a single pass.
+
+        Args:
+            data (dict): Nested dictionary to convert.
+            copy (bool):
+                Copies the nested `FlexDict` instances inside `data` if
+                `True`. Otherwise they are adopted in place, which skips
+                copying them entirely and is only safe for trusted input.
+
+        Returns:
+            FlexDict: The converted dictionary.
+        """
+        if not isinstance(data, dict):
+            raise ValueError(
+                'FlexDict can only be initialized with instances of dict!'
+            )
+        if not copy and isinstance(data, cls):
+            return data
+        return cls().__build(data, copy=copy)
+
+    @classmethod
+    def from_flat(cls, items, sep=None):
+        """
+        Creates a FlexDict from flattened items; the inverse of `flatten`.
+
+        Nested dictionaries shared by consecutive key-paths are created and
+        looked up only once, so sorted or grouped items are the fastest.
+
+        Args:
+            items (iterable): Pairs of key-paths and values.
+            sep (str):
+                Splits string key-paths with `sep` if provided, e.g.
+                `'a.b.c'` into `['a', 'b', 'c']` for `'.'`.
+
+        Returns:
+            FlexDict: The unflattened dictionary.
+        """
+        flex = cls()
+        parent, nodes = (), [flex]
+        for path, value in items:
+            if isinstance(path, list):
+                path = tuple(path)
+            elif sep is not None and isinstance(path, _TEXT):
+                path = tuple(path.split(sep))
+            elif not isinstance(path, tuple):
+                path = cls.__as_path(path)
+            if not path:
+                raise ValueError('Key-paths cannot be empty!')
+            if path[:-1] != parent:
+                parent, nodes = flex.__reach(parent, nodes, path[:-1])
+            node, key = nodes[-1], path[-1]
+            if node is None:
+                flex[path] = value
+            elif isinstance(value, dict):
+                node.__assign(key, value)
+            else:
+                dict.__setitem__(node, key, value)
+        return flex
+
+    def __reach(self, parent, nodes, path):  # pylint: disable=W0238
+        """
+        Resolves `path` for `from_flat`, creating the missing nodes and
+        reusing the ones resolved for the previous `parent`. The last node
+        is `None` if `path` runs into a value.
+        """
+        depth, limit = 0, min(len(parent), len(path))
+        while depth < limit and parent[depth] == path[depth]:
+            depth += 1
+        del nodes[depth + 1:]
+        node = nodes[-1]
+        for key in path[depth:]:
+            child = dict.get(node, key, _MISSING)
+            if child is _MISSING:
+                child = self.__node()
+                dict.__setitem__(node, key, child)
+            elif not isinstance(child, FlexDict):
+                return (), [self, None]
+            nodes.append(child)
+            node = child
+        return path, nodes
+
+    @classmethod
+    def to_columns(cls, records, paths=None, dtypes=None):
+        """
+        Converts the values of many dictionaries into NumPy arrays.
+
+        Each dictionary is walked once and its values are written into
+        preallocated typed arrays, one per key-path. Requires NumPy.
+
+        Args:
+            records (iterable): Dictionaries to convert.
+            paths (iterable):
+                Key-paths of the columns. Uses the key-paths of the values
+                of the first dictionary if `None`.
+            dtypes (dict):
+                NumPy data types of the columns by key-path. Data types are
+                inferred from the first value of each column otherwise.
+
+        Returns:
+            dict:
+                `KeyPath` and `numpy.ma.MaskedArray` pairs. Values missing
+                from a dictionary are masked.
+        """
+        numpy = _numpy()
+        records = records if isinstance(records, list) else list(records)
+        if paths is None:
+            paths = [
+                tuple(path) + (key,)
+                for path, key, _, _ in cls.__walk(records[0], leaves=True)
+            ] if records else []
+        paths = [KeyPath(*cls.__as_path(keys)) for keys in paths]
+        dtypes = {
+            KeyPath(*cls.__as_path(keys)): dtype
+            for keys, dtype in (dtypes or {}).items()
+        }
+        data = dict.fromkeys(paths)
+        masks = {path: numpy.ones(len(records), 'bool') for path in paths}
+        for row, record in enumerate(records):
+            nodes = {(): record}
+            for path in paths:
+                value = cls.__lookup(
+                    cls.__prefix(nodes, path[:-1], cls.__lookup), path[-1]
+                ) if path else record
+                if value is _MISSING:
+                    continue
+                column = data[path]
+                if column is None:
+                    column = data[path] = numpy.zeros(len(records), dtypes.get(
+                        path, _DTYPES.get(type(value), 'object')
+                    ))
+                if path in dtypes:
+                    column[row] = value
+                else:
+                    data[path] = cls.__fill(column, row, value)
+                masks[path][row] = False
+        return {
+            path: numpy.ma.MaskedArray(
+                numpy.zeros(len(records), 'object')
+                if data[path] is None else data[path],
+                mask=masks[path]
+            )
+            for path in paths
+        }
+
+    @staticmethod
+    def __fill(column, row, value):
+        """
+        Writes `value` into an inferred `column`, widening the column to a
+        floating point or object array if `value` does not fit in it.
+        Integers out of the range of int64 go into object arrays.
+        """
+        dtype, kind = str(column.dtype), _DTYPES.get(type(value), 'object')
+        if kind == 'int64' and not -2 ** 63 <= value < 2 ** 63:
+            kind = 'object'
+        if dtype not in (kind, 'object') and (dtype, kind) != (
+                'float64', 'int64'
+        ):
+            column = column.astype('float64' if (dtype, kind) == (
+                'int64', 'float64'
+            ) else 'object')
+        column[row] = value
+        return column
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Converts NumPy arrays back into dictionaries; the inverse of
+        `to_columns`.
+
+        Args:
+            columns (dict):
+                Key-paths and arrays (or masked arrays) of the same length.
+                Masked values are left out of the dictionaries.
+
+        Returns:
+            list: The dictionaries, one per row of the arrays.
+        """
+        numpy = _numpy()
+        rows = [
+            (cls.__as_path(keys), numpy.ma.getdata(column).tolist(),
+             numpy.ma.getmaskarray(column).tolist())
+            for keys, column in columns.items()
+        ]
+        return [
+            cls.from_flat(
+                (path, values[row])
+                for path, values, mask in rows if not mask[row]
+            )
+            for row in range(len(rows[0][1]) if rows else 0)
+        ]
+
+    def to_bytes(self):
+        """
+        Encodes the dictionary into a compact binary format.
+
+        Every distinct key is stored only once and the structure is stored
+        apart from the values, which are pickled. The lock states of the
+        dictionary and of its nested dictionaries are stored along with the
+        data.
+
+        Returns:
+            bytes: The encoded dictionary.
+
+        Raises:
+            ValueError: If a dictionary contains itself.
+        """
+        return _encode(self)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Decodes a FlexDict encoded via `to_bytes`.
+
+        Nested dictionaries are rebuilt in a single pass, without going
+        through item assignment. Pickled values are unpickled, so only
+        decode data from trusted sources.
+
+        Args:
+            data (bytes): The encoded dictionary.
+
+        Returns:
+            FlexDict: The decoded dictionary.
+        """
+        if data[:len(_MAGIC)] != _MAGIC:
+            raise ValueError('Data is not encoded by FlexDict!')
+        flex = cls()
+        flex.__setstate__(pickle.loads(data[len(_MAGIC):]))  # nosec
+        return flex
+
+    def __decode(self, table, shape, values, locks):
+        """Fills `self` with items encoded by `_parts`."""
+        shape, values, locks = iter(shape), iter(values), dict(locks)
+        setitem, cls, ctx = dict.__setitem__, type(self), self._ctx
+        stack, number = [[self, next(shape)]], 0
+        locked = [(self, locks[0])] if 0 in locks else []
+        while stack:
+            frame = stack[-1]
+            if not frame[1]:
+                stack.pop()
+                continue
+            frame[1] -= 1
+            index = next(shape)
+            if index & 1:
+                child = cls.__new__(cls)
+                child._ctx = ctx
+                setitem(frame[0], table[index >> 1], child)
+                stack.append([child, next(shape)])
+                number += 1
+                if number in locks:
+                    locked.append((child, locks[number]))
+            else:
+                setitem(frame[0], table[index >> 1], next(values))
+        for node, state in locked:
+            node.__own_context().set_lock(state)
+
+    @classmethod
+    def load_stream(cls, fp, select=None):
+        """
+        Loads a JSON document straight into a FlexDict.
+
+        JSON objects are turned into FlexDicts by the decoder's
+        `object_pairs_hook`. JSON objects inside arrays are loaded as
+        FlexDicts too. The whole document is still parsed and held in memory
+        while it loads.
+
+        Args:
+            fp (file): File object to read the JSON document from.
+            select (iterable):
+                Key(s) of the subtrees to load. Other subtrees are parsed
+                but dropped instead of being converted. Loads everything if
+                `None`.
+
+        Returns:
+            FlexDict: The loaded document.
+        """
+        return cls.__load(json.load, fp, select)
+
+    @classmethod
+    def iter_jsonl(cls, fp, select=None):
+        """
+        Loads JSON Lines records straight into FlexDicts, one at a time.
+
+        Args:
+            fp (file): File object to read the records from.
+            select (iterable):
+                Key(s) of the subtrees to load from each record. Other
+                subtrees are parsed but dropped instead of being converted.
+                Loads everything if `None`.
+
+        Yields:
+            FlexDict: The loaded records.
+        """
+        for line in fp:
+            if line.strip():
+                yield cls.__load(json.loads, line, select)
+
+    @classmethod
+    def __load(cls, load, source, select):
+        root = cls()
+        if select is None:
+            def hook(pairs):
+                node = root.__node()
+                dict.update(node, pairs)
+                return node
+            data = load(source, object_pairs_hook=hook)
+        else:
+            data = load(source, object_pairs_hook=_Pairs)
+        if not isinstance(data, (FlexDict, _Pairs)):
+            raise ValueError(
+                'FlexDict can only be initialized with instances of dict!'
+            )
+        if select is None:
+            dict.update(root, data)
+            return root
+        trie = {}
+        for keys in select:
+            cls.__graft(trie, cls.__as_path(keys))
+        root.__from_pairs(data, trie)
+        return root
+
+    @staticmethod
+    def __graft(trie, path):
+        """Adds a selected path to the selection trie."""
+        for key in path[:-1]:
+            trie = trie.setdefault(key, {})
+            if trie is None:
+                return
+        if path:
+            trie[path[-1]] = None
+        else:
+            trie.clear()
+            trie[_MISSING] = None
+
+    def __from_pairs(self, pairs, trie):  # pylint: disable=W0238
+        """
+        Converts parsed JSON objects into nested FlexDicts top-down. Only the
+        items selected by `trie` are converted if `trie` is not `None`.
+        Consumed pairs are released as the conversion goes.
+        """
+        if trie is not None and _MISSING in trie:
+            trie = None
+        stack = [(self, pairs, trie)]
+        while stack:
+            target, source, trie = stack.pop()
+            items = source if isinstance(source, _Pairs) else enumerate(
+                source
+            )
+            for key, value in items:
+                sub = self.__select(trie, key, value)
+                if sub is _MISSING:
+                    continue
+                if isinstance(value, _Pairs):
+                    child = self.__node()
+                    stack.append((child, value, sub))
+                    value = child
+                elif isinstance(value, list):
+                    stack.append((value, value, None))
+                if isinstance(target, FlexDict):
+                    dict.__setitem__(target, key, value)
+                else:
+                    target[key] = value
+            if isinstance(source, _Pairs):
+                del source[:]
+
+    @staticmethod
+    def __select(trie, key, value):
+        """Gets the selection trie of an item, `_MISSING` if not selected."""
+        if trie is None:
+            return None
+        sub = trie.get(key, _MISSING)
+        if sub is not None and not isinstance(value, _Pairs):
+            return _MISSING
+        return sub
+
+    def get(self, keys, default=None):
+        """
+        Gets a value from the dictionary with the provided keys.
+
+        Args:
+            keys: Keys pointing to the target value.
+            default (any): Default value to return if target does not exists.
+
+        Returns:
+            any: The corresponding dictionary value.
+        """
+        keys = self.__sanitize(keys)
+        if isinstance(keys, (list, KeyPath)):
+            node = self
+            for key in keys:
+                if isinstance(node, dict):
+                    node = dict.get(node, key, _MISSING)
+                    if node is _MISSING:
+                        return default
+                elif key in node:
+                    node = node[key]
+                else:
+                    return default
+            return node
+        return dict.get(self, keys, default)
+
+    def probe(self, keys):
+        """
+        Gets a value from the dictionary without creating nested
+        dictionaries, whether probe mode is enabled or not.
+
+        Args:
+            keys: Keys pointing to the target value.
+
+        Returns:
+            any:
+                The corresponding dictionary value, or `MISSING` if a key is
+                missing or the keys pass through a value which is not a
+                dictionary.
+        """
+        keys = self.__sanitize(keys)
+        if not isinstance(keys, (list, KeyPath)):
+            return dict.get(self, keys, MISSING)
+        node = self
+        for key in keys:
+            if not isinstance(node, dict):
+                return MISSING
+            node = dict.get(node, key, MISSING)
+        return node
+
+    def query(self, pattern):
+        """
+        Gets the items at the key-paths matching a pattern, in a single
+        traversal which skips the nested dictionaries that cannot match.
+
+        Args:
+            pattern (Union[Query, iterable]):
+                Keys of the pattern, where `'*'` stands for any key and
+                `'**'` for any number of keys, none included, or a `Query`
+                compiled from them.
+
+        Returns:
+            list: `(KeyPath, value)` pairs of the items, depth-first.
+        """
+        if not isinstance(pattern, Query):
+            pattern = Query(*self.__as_path(pattern))
+        return pattern.match(self)
+
+    def get_many(self, paths, default=None):
+        """
+        Gets multiple values from the dictionary at once.
+
+        Every nested dictionary shared by the paths is resolved only once per
+        call, which makes fetching many values under a common prefix cheap.
+
+        Args:
+            paths (iterable): Key(s) pointing to each target value.
+            default (any): Default value for the targets that do not exist.
+
+        Returns:
+            list: The corresponding dictionary values, in order.
+        """
+        nodes = {(): self}
+        prefix, lookup = self.__prefix, self.__lookup
+        results = []
+        for keys in paths:
+            path = self.__as_path(keys)
+            if path:
+                node = lookup(prefix(nodes, path[:-1], lookup), path[-1])
+            else:
+                node = self
+            results.append(default if node is _MISSING else node)
+        return results
+
+    def set_many(self, items, increment=False):
+        """
+        Sets multiple dictionary values at once.
+
+        Every nested dictionary shared by the paths is resolved only once per
+        call, which makes setting many values under a common prefix cheap.
+        Items are set in order, exactly like consecutive item assignments.
+
+        Args:
+            items (Union[dict, iterable]):
+                Mapping or pairs of key(s) and values to set.
+            increment (bool):
+                Increments the values by the given ones if set to `True`,
+                like `set` does.
+
+        Raises:
+            ValueError:
+                If a key-path is empty, like `set`. The items before it are
+                set already.
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        nodes = {(): self}
+        for keys, value in items:
+            path = self.__as_path(keys)
+            if not path:
+                raise ValueError('Key-paths cannot be empty!')
+            node = self.__prefix(nodes, path[:-1], self.__descend)
+            if increment:
+                current = self.__lookup(node, path[-1])
+                if current is not _MISSING:
+                    value = self.__increment(current, value)
+            if isinstance(node, FlexDict):
+                node.__assign(path[-1], value)
+            else:
+                node[path[-1]] = value
+            if path in nodes:
+                nodes = {(): self}
+
+    __as_path = staticmethod(_as_path)
+
+    @staticmethod
+    def __prefix(nodes, path, step):
+        """
+        Resolves `path` by extending the longest already resolved prefix in
+        `nodes` with `step`, caching every new prefix on the way.
+        """
+        node = nodes.get(path, _MISSING)
+        if node is not _MISSING:
+            return node
+        depth = len(path) - 1
+        while path[:depth] not in nodes:
+            depth -= 1
+        node = nodes[path[:depth]]
+        for depth in range(depth, len(path)):
+            node = step(node, path[depth])
+            nodes[path[:depth + 1]] = node
+        return node
+
+    @staticmethod
+    def __lookup(node, key):
+        if node is _MISSING:
+            return node
+        if isinstance(node, dict):
+            return dict.get(node, key, _MISSING)
+        return node[key] if key in node else _MISSING
+
+    @staticmethod
+    def __descend(node, key):
+        if isinstance(node, FlexDict):
+            child = dict.get(node, key, _MISSING)
+            return node.__child(key) if child is _MISSING else child
+        return node[key]
+
+    def set(self, keys, value, overwrite=True, increment=False, merge=None):
+        """
+        Sets a dictionary value with the given keys.
+
+        The target is resolved with a single walk from the root, whichever
+        options are used.
+
+        Args:
+            keys (any): Key(s) pointing to the value.
+            value (any): Value to set.
+            overwrite (bool): If `False`, only sets a value if it not exists.
+            increment (bool):
+                Increments the value by `value` if set to `True`.
+                `overwrite` argument has no effect on this.
+                Causes the method to return the target value.
+            merge (callable):
+                Function called with the existing and the new value to
+                compute the value to set, if the target exists.
+                `overwrite` argument has no effect on this.
+                Causes the method to return the target value.
+
+        Returns:
+            Union[int, float, None]:
+                Final state of the target value if `increment` or `merge`
+                is enabled.
+
+        Raises:
+            ValueError: If `keys` is an empty key-path.
+        """
+        keys = self.__sanitize(keys)
+        if isinstance(keys, (list, KeyPath)):
+            if not keys:
+                raise ValueError('Key-paths cannot be empty!')
+            node, key = self.__resolve(keys, len(keys) - 1), keys[-1]
+        else:
+            node, key = self, keys
+        if isinstance(node, dict):
+            current = dict.get(node, key, _MISSING)
+        else:
+            current = node[key] if key in node else _MISSING
+        if increment:
+            merge = self.__increment
+        if merge is not None:
+            if current is not _MISSING:
+                value = merge(current, value)
+        elif not overwrite and current is not _MISSING:
+            return None
+        if isinstance(node, FlexDict):
+            node.__assign(key, value)
+            value = dict.__getitem__(node, key)
+        else:
+            node[key] = value
+        return None if merge is None else value
+
+    @staticmethod
+    def __increment(current, value):
+        return value if not current else current + value
+
+    def merge(self, other, strategy='override', copy=True):
+        """
+        Deeply merges another dictionary into the dictionary.
+
+        Only the nested dictionaries present in both are descended into;
+        subtrees missing from `self` are taken over as a whole.
+
+        Args:
+            other (dict): Dictionary to merge.
+            strategy (Union[str, callable]):
+                Resolves the values present in both dictionaries.
+                'override'
+                    Uses the value of `other`.
+                'keep'
+                    Keeps the value of `self`.
+                'sum'
+                    Increments the value of `self` by the value of `other`,
+                    like `set` with `increment` enabled.
+                'append'
+                    Concatenates both values into a list.
+                callable
+                    Function called with the existing and the new value to
+                    compute the value to set.
+            copy (bool):
+                Copies the nested `FlexDict` instances inside `other` if
+                `True`. Otherwise they are adopted in place, which skips
+                copying them entirely and is only safe for trusted input.
+        """
+        if not isinstance(other, dict):
+            raise ValueError('FlexDict can only merge instances of dict!')
+        resolve = self.__strategy(strategy)
+        stack = [(self, other)]
+        push, pop = stack.append, stack.pop
+        while stack:
+            node, source = pop()
+            for key, value in source.items():
+                current = dict.get(node, key, _MISSING)
+                if current is _MISSING:
+                    node.__put(key, value, copy)
+                elif isinstance(current, FlexDict) and isinstance(value, dict):
+                    if current is not value:
+                        push((current, value))
+                else:
+                    value = resolve(current, value)
+                    if value is not current:
+                        node.__put(key, value, copy)
+
+    def merge_many(self, others, strategy='override', copy=True):
+        """
+        Deeply merges many dictionaries into the dictionary, in order.
+
+        Args:
+            others (iterable): Dictionaries to merge.
+            strategy (Union[str, callable]): See `merge`.
+            copy (bool): See `merge`.
+        """
+        for other in others:
+            self.merge(other, strategy=strategy, copy=copy)
+
+    @classmethod
+    def aggregate(cls, records, mapper=None, processes=None,
+                  chunksize=10000):
+        """
+        Sums values into a FlexDict using a pool of processes.
+
+        Records are split into chunks which are summed by the workers into
+        partial FlexDicts, like `set` with `increment` enabled. Partial
+        results are then merged pairwise, in order, until one is left. The
+        result is the same as summing every value in a single process.
+
+        Args:
+            records (iterable): Pairs of key(s) and values to sum.
+            mapper (callable):
+                Turns each record into an iterable of pairs of key(s) and
+                values to sum, inside the workers. Must be defined at the top
+                level of a module so that it can be pickled.
+            processes (int):
+                Number of worker processes; the number of CPUs if `None`.
+                Sums everything in the current process if `1`.
+            chunksize (int): Number of records sent to a worker at once.
+
+        Returns:
+            FlexDict: The summed values.
+        """
+        if processes == 1:
+            return _aggregate((cls, mapper, records))
+        records = iter(records)
+        chunks = iter(lambda: list(islice(records, chunksize)), [])
+        pool = Pool(processes)
+        try:
+            partials = list(pool.imap(
+                _aggregate, ((cls, mapper, chunk) for chunk in chunks)
+            ))
+            while len(partials) > 1:
+                merged = pool.map(
+                    _merge_sum, list(zip(partials[::2], partials[1::2]))
+                )
+                if len(partials) % 2:
+                    merged.append(partials[-1])
+                partials = merged
+        finally:
+            pool.close()
+            pool.join()
+        return partials[0] if partials else cls()
+
+    @classmethod
+    def __strategy(cls, strategy):
+        if callable(strategy):
+            return strategy
+        strategies = {
+            'override': cls.__override,
+            'keep': cls.__keep,
+            'sum': cls.__increment,
+            'append': cls.__append,
+        }
+        if strategy not in strategies:
+            raise ValueError(
+                'Unknown merge strategy: {!r}'.format(strategy)
+            )
+        return strategies[strategy]
+
+    @staticmethod
+    def __override(current, value):  # pylint: disable=W0613
+        return value
+
+    @staticmethod
+    def __keep(current, value):  # pylint: disable=W0613
+        return current
+
+    @staticmethod
+    def __append(current, value):
+        current = current if isinstance(current, list) else [current]
+        return current + (value if isinstance(value, list) else [value])
+
+    def __put(self, key, value, copy):  # pylint: disable=W0238
+        """Stores `value`, adopting it instead of copying if not `copy`."""
+        if isinstance(value, dict):
+            if copy or type(value) is not type(self):
+                value = self.__node().__build(value, copy=copy)
+            else:
+                value.__adopt(self._ctx)
+        self.__store(key, value)
+
+    def diff(self, other):
+        """
+        Compares the dictionary with another one, item by item.
+
+        Identical subtrees, such as the unchanged ones shared by the
+        snapshots created via `freeze`, are skipped without being traversed.
+
+        Args:
+            other (dict): Dictionary to compare with.
+
+        Returns:
+            list:
+                `(path, old, new)` tuples for every changed `KeyPath`, where
+                `old` is the value in `self` and `new` the one in `other`.
+                A subtree missing from either side is reported once, with
+                `MISSING` as its value on that side.
+        """
+        if not isinstance(other, dict):
+            raise ValueError('FlexDict can only be compared with dict!')
+        changes = []
+        stack = [((), self, other)]
+        while stack:
+            path, first, second = stack.pop()
+            branches = []
+            for key, old in first.items():
+                new = dict.get(second, key, _MISSING)
+                if old is new:
+                    continue
+                if new is _MISSING:
+                    changes.append((tuple.__new__(
+                        KeyPath, path + (key,)
+                    ), old, MISSING))
+                elif isinstance(old, dict) and isinstance(new, dict):
+                    branches.append((path + (key,), old, new))
+                elif not old == new:
+                    changes.append((tuple.__new__(
+                        KeyPath, path + (key,)
+                    ), old, new))
+            for key, new in second.items():
+                if key not in first:
+                    changes.append((tuple.__new__(
+                        KeyPath, path + (key,)
+                    ), MISSING, new))
+            stack.extend(reversed(branches))
+        return changes
+
+    def apply_patch(self, patch):
+        """
+        Applies changes produced by `diff`.
+
+        Args:
+            patch (iterable):
+                `(path, old, new)` tuples. The value at each path is set to
+                `new`, or deleted if `new` is `MISSING`.
+        """
+        for path, _, new in patch:
+            if new is MISSING:
+                del self[path]
+            else:
+                self[path] = new
+
+    def keys(self, nested=False, unique=False):
+        """
+        Gets keys from the dictionary.
+
+        Args:
+            nested (bool): Gets all keys recursively if set to `True`.
+            unique (bool): Gets only the unique keys if set to `True`.
+
+        Returns:
+            Union[dict_keys, list, set]:
+                dict_keys
+                    If `nested` is `False` and `unique` is `False`.
+                list
+                    If `nested` is `True` and `unique` is `False`.
+                set
+                    If `unique` is `True`.
+        """
+        if not nested:
+            return dict.keys(self)
+        keys = set() if unique else []
+        self.__keys(self, keys.add if unique else keys.append)
+        return keys
+
+    def values(self, nested=False, unique=False):
+        """
+        Gets values from the dictionary.
+
+        Args:
+            nested (bool): Gets all values recursively if set to `True`.
+            unique (bool): Gets only the unique values if set to `True`.
+
+        Returns:
+            Union[dict_values list, set]:
+                dict_values
+                    If `nested` is `False` and `unique` is `False`.
+                list:
+                    If `nested` is `True` and `unique` is `False`.
+                list:
+                    If `unique` is `True`.
+        """
+        if nested:
+            vals = []
+            self.__leaves(self, vals.append)
+        else:
+            vals = list(dict.values(self))
+        return (
+            vals
+            if not unique
+            else list(set(vals))
+            if not nested
+            else set(vals)
+        )
+
+    def freeze(self):
+        """
+        Creates an immutable and hashable snapshot of the dictionary.
+
+        Subtrees which did not change since the previous snapshot of the
+        dictionary are shared with it instead of being copied. The hash of
+        each frozen subtree is computed once, when it is first needed.
+
+        Returns:
+            FrozenFlexDict: The snapshot.
+        """
+        ctx = self._ctx
+        base = ctx.snapshot if ctx.owner() is self else None
+        root = FrozenFlexDict.__new__(FrozenFlexDict)
+        root._ctx, root._hash = _Context(root), None
+        root._ctx.set_lock(True)
+        stack = [[self, base, iter(self.items()), {}, None]]
+        while stack:
+            _, base, items, frozen, _ = frame = stack[-1]
+            for key, value in items:
+                if isinstance(value, dict):
+                    old = dict.get(base, key) if base is not None else None
+                    if not isinstance(old, FrozenFlexDict):
+                        old = None
+                    stack.append([value, old, iter(value.items()), {}, key])
+                    break
+                frozen[key] = value
+            else:
+                stack.pop()
+                if base is None or not self.__same(base, frozen):
+                    base = root if not stack else FrozenFlexDict.__new__(
+                        FrozenFlexDict
+                    )
+                    base._ctx, base._hash = root._ctx, None
+                    dict.update(base, frozen)
+                if stack:
+                    stack[-1][3][frame[4]] = base
+        if ctx.owner() is self:
+            ctx.snapshot = base
+        return base
+
+    @staticmethod
+    def __same(snapshot, items):
+        if len(snapshot) != len(items):
+            return False
+        for key, value in items.items():
+            if dict.get(snapshot, key, _MISSING) is not value:
+                return False
+        return True
+
+    def pop(self):
+        """
+        Removes and returns the last key-value pair from the dictionary.
+
+        Returns:
+            Union[FlexDict, None]:
+                FlexDict
+                    The last key-value pair of the dictionary.
+                None
+                    If `self` is empty.
+        """
+        if self:
+            key, val = list(self.items())[-1]
+            self.__remove(key)
+            return FlexDict({key: val})
+        return None
+
+    def prune(self):
+        """
+        Removes the empty nested dictionaries, along with the ones left
+        empty by their removal, in a single pass.
+
+        Returns:
+            int: Number of removed dictionaries.
+        """
+        removed = 0
+        stack = [(self, iter(dict.items(self)), [], None)]
+        while stack:
+            node, items, empty, key = stack[-1]
+            for child, value in items:
+                if isinstance(value, FlexDict):
+                    if value:
+                        stack.append((value, iter(dict.items(value)), [],
+                                      child))
+                        break
+                    empty.append(child)
+            else:
+                stack.pop()
+                for child in empty:
+                    node.__remove(child)
+                removed += len(empty)
+                if stack and not node:
+                    stack[-1][2].append(key)
+        return removed
+
+    def length(self, nested=False, unique=False):
+        """
+        Counts the number of keys inside the dictionary.
+
+        Args:
+            nested (bool): Counts all keys recursively if set to `True`.
+            unique (bool): Counts only the unique keys if set to `True`.
+
+        Returns:
+            int: Number of keys.
+        """
+        if nested and not unique:
+            return self.__count(self)
+        return len(self.keys(nested=nested, unique=unique))
+
+    def size(self, unique=False):
+        """
+        Counts the number of keys and values inside the dictionary.
+
+        Args:
+            nested (bool): Counts all items recursively if set to `True`.
+            unique (bool): Counts only the unique items if set to `True`.
+
+        Returns:
+            int: Number of items.
+        """
+        if not unique:
+            return sum(
+                1 if branch else 2
+                for _, _, _, branch in self.__walk(self)
+            )
+        return len(self.keys(nested=True, unique=unique)) + len(
+            self.values(nested=True, unique=unique)
+        )
+
+    def flatten(self):
+        """
+        Flattens the dictionary.
+
+        Returns:
+            list: A list of tuples containing key-paths and values.
+        """
+        items = []
+        add = items.append
+        path = []
+        stack = [iter(self.items())]
+        push, pop = stack.append, stack.pop
+        while stack:
+            for key, value in stack[-1]:
+                if isinstance(value, dict) and value:
+                    path.append(key)
+                    push(iter(value.items()))
+                    break
+                add((path + [key], value))
+            else:
+                pop()
+                if path:
+                    path.pop()
+        return items
+
+    def iterflatten(self, sep=None):
+        """
+        Lazily flattens the dictionary.
+
+        Args:
+            sep (str):
+                Joins the keys of each key-path into a string with `sep` if
+                provided, e.g. `'a.b.c'` for `'.'`.
+
+        Yields:
+            tuple: Key-path and value pairs.
+        """
+        for path, key, value, _ in self.__walk(self, leaves=True):
+            if sep is None:
+                yield path + [key], value
+            else:
+                yield sep.join(map(str, path + [key])), value
+
+    def iterkeys(self, nested=False):
+        """
+        Lazily gets keys from the dictionary.
+
+        Args:
+            nested (bool): Gets all keys recursively if set to `True`.
+
+        Yields:
+            any: Keys of the dictionary.
+        """
+        if not nested:
+            for key in dict.keys(self):
+                yield key
+            return
+        for _, key, _, _ in self.__walk(self):
+            yield key
+
+    def itervalues(self, nested=False):
+        """
+        Lazily gets values from the dictionary.
+
+        Args:
+            nested (bool): Gets all values recursively if set to `True`.
+
+        Yields:
+            any: Values of the dictionary.
+        """
+        if not nested:
+            for value in dict.values(self):
+                yield value
+            return
+        for _, _, value, _ in self.__walk(self, leaves=True):
+            yield value
+
+    def write_csv(self, fp, sep='.'):
+        """
+        Writes the flattened dictionary to a file object as CSV rows.
+
+        Each row holds a key-path joined with `sep` and its value. Rows are
+        written as the dictionary is traversed.
+
+        Args:
+            fp (file): File object to write the rows to.
+            sep (str): Separator of the keys of the key-paths.
+        """
+        csv.writer(fp).writerows(self.iterflatten(sep=sep))
+
+    def write_jsonl(self, fp, sep=None):
+        """
+        Writes the flattened dictionary to a file object as JSON Lines.
+
+        Each line holds a single value. Lines are written as the dictionary
+        is traversed.
+
+        Args:
+            fp (file): File object to write the lines to.
+            sep (str):
+                Writes `{"<key-path joined with sep>": value}` objects if
+                provided, `{"path": [key-path], "value": value}` otherwise.
+        """
+        for path, value in self.iterflatten(sep=sep):
+            fp.write(json.dumps(
+                {path: value} if sep is not None
+                else {'path': path, 'value': value}
+            ))
+            fp.write('\n')
+
+    def write_mapped(self, fp):
+        """
+        Writes the dictionary to a file object in the indexed binary layout
+        read by `MappedFlexDict`.
+
+        Every distinct key is stored only once and values are pickled one
+        by one, so they can be read without loading the rest of the file.
+        The lock state is stored along with the data.
+
+        Args:
+            fp (file): File object, opened in binary mode, to write to.
+        """
+        _write_mapped(self, fp, self.locked)
+
+    def lock(self, inplace=True):
+        """
+        Locks the automatic nesting mechanism.
+
+        The lock state is shared by the nested dictionaries, so locking
+        takes constant time regardless of the size of the dictionary.
+
+        Args:
+            inplace (bool): Creates a locked copy if `True`.
+
+        Returns:
+            Union[None, FlexDict]:
+                None
+                    If `inplace` is set to `True`.
+                FlexDict
+                    If `inplace`set to `False`.
+        """
+        return self.__lock(True, inplace)
+
+    def unlock(self, inplace=True):
+        """
+        Unlocks the automatic nesting mechanism.
+
+        Args:
+            inplace (bool): Creates an unlocked copy if `True`.
+
+        Returns:
+            Union[None, FlexDict]:
+                None
+                    If `inplace` is set to `True`.
+                FlexDict
+                    If `inplace`set to `False`.
+        """
+        return self.__lock(False, inplace)
+
+    def contains(self, subset):
+        """
+        Checks if this dictionary is a superset of a given one.
+
+        Args:
+            subset (dict): Dictionary to check if it is a subset.
+
+        Returns:
+            bool: `True` if `self` contains `subset` else `False`.
+        """
+        return self.__contains(self, subset)
+
+    def inside(self, superset):
+        """
+        Checks if this dictionary is a subset of a given one.
+
+        Args:
+            superset (dict): Dictionary to check if it is a superset.
+
+        Returns:
+            bool: `True` if `self` is inside the `superset` else `False`.
+        """
+        return self.__contains(superset, self)
+
+    def build_index(self):
+        """
+        Indexes the keys and leaf values of the dictionary.
+
+        The index speeds up repeated `contains` queries (and `inside` queries
+        made against this dictionary) by only checking the nested
+        dictionaries holding the queried items. It is kept up-to-date as the
+        dictionary is modified through FlexDict methods.
+        """
+        ctx = self.__own_context()
+        if ctx.tracker is None:
+            ctx.tracker = _Tracker(self)
+        if 'subset' not in ctx.tracker.observers:
+            ctx.tracker.observe('subset', _SubsetIndex(), self)
+
+    def drop_index(self, key=MISSING, path=None):
+        """
+        Removes the index created by `build_index`, or the one created by
+        `create_index` if `key` or `path` is provided.
+
+        Args:
+            key (any): Key of the index created by `create_index`.
+            path (iterable): Key-path pattern of the index.
+        """
+        tracker = self.__tracker()
+        name = 'subset' if key is MISSING and path is None else (
+            self.__value_index(key, path).name
+        )
+        if tracker is not None and name in tracker.observers:
+            del tracker.observers[name]
+            if tracker.idle:
+                self._ctx.tracker = None
+
+    def create_index(self, key=MISSING, path=None):
+        """
+        Indexes the values under a key, wherever it is, or the values at
+        the key-paths matching a pattern, where `'*'` stands for any key.
+
+        The index lets `find` get the key-paths of the values without
+        traversing the dictionary. It is kept up-to-date as the dictionary
+        is modified through FlexDict methods.
+
+        Args:
+            key (any): Key of the values to index.
+            path (iterable): Key-path pattern of the values to index.
+        """
+        index = self.__value_index(key, path)
+        ctx = self.__own_context()
+        if ctx.tracker is None:
+            ctx.tracker = _Tracker(self)
+        if index.name not in ctx.tracker.observers:
+            ctx.tracker.observe(index.name, index, self)
+
+    def find(self, key=MISSING, value=MISSING, path=None):
+        """
+        Finds the key-paths of the values under a key, or at the key-paths
+        matching a pattern, where `'*'` stands for any key.
+
+        Uses the index created by `create_index` for the same key or
+        pattern, traverses the dictionary otherwise.
+
+        Args:
+            key (any): Key of the values to find.
+            value (any): Finds only the values equal to `value` if provided.
+            path (iterable): Key-path pattern of the values to find.
+
+        Returns:
+            list: `KeyPath`s of the values, in no particular order.
+        """
+        index = self.__value_index(key, path)
+        tracker = self.__tracker()
+        if tracker is not None and index.name in tracker.observers:
+            index = tracker.observers[index.name]
+        else:
+            for keys, child, val, _ in self.__walk(self):
+                index.add(self, tuple(keys), child, val)
+        return index.find(value)
+
+    def __value_index(self, key, path):
+        """Creates an empty index of `create_index`, named after its target."""
+        if (key is MISSING) == (path is None):
+            raise ValueError('Either a key or a path pattern is required!')
+        return _ValueIndex(
+            key, None if path is None else tuple(self.__as_path(path))
+        )
+
+    def enable_journal(self, maxlen=1024):
+        """
+        Starts recording the changes made to the dictionary.
+
+        Every value set or deleted through FlexDict methods, at any level,
+        is recorded along with its key-path and previous value. Nested
+        dictionaries are copied as they are recorded, so the journal keeps
+        them as they were at the time. Nothing is recorded, and no time is
+        spent, while the journal is disabled.
+
+        Args:
+            maxlen (int):
+                Number of changes to keep. The oldest changes are discarded
+                once it is reached.
+        """
+        ctx = self.__own_context()
+        if ctx.tracker is None:
+            ctx.tracker = _Tracker(self)
+        journal = ctx.tracker.journal
+        if journal is None:
+            ctx.tracker.journal = _Journal(maxlen)
+        elif journal.records.maxlen != maxlen:
+            journal.records = deque(journal.records, maxlen=maxlen)
+
+    def disable_journal(self):
+        """
+        Stops recording changes and discards the recorded ones.
+        """
+        tracker = self.__tracker()
+        if tracker is not None and tracker.journal is not None:
+            tracker.journal = None
+            if tracker.idle:
+                self._ctx.tracker = None
+
+    def changes(self, since=0):
+        """
+        Gets the changes recorded by the journal.
+
+        Args:
+            since (int):
+                Sequence number of the last change already seen; only the
+                changes following it are returned.
+
+        Returns:
+            list:
+                `(sequence, path, old, new)` tuples in order, where `path`
+                is a `KeyPath` and `MISSING` marks a value which did not
+                exist before or does not exist anymore.
+
+        Raises:
+            ValueError:
+                If the journal is not enabled or some of the changes since
+                `since` were already discarded.
+        """
+        tracker = self.__tracker()
+        if tracker is None or tracker.journal is None:
+            raise ValueError('The journal is not enabled!')
+        return tracker.journal.since(since)
+
+
+class FrozenFlexDict(FlexDict):
+    """
+    Immutable and hashable snapshot of a FlexDict.
+
+    Snapshots are created via `FlexDict.freeze`. They are always locked,
+    cannot be modified and are hashed by their content. Since snapshots
+    share their unchanged subtrees, the probe mode, the indexes and the
+    journal cannot be set on them either.
+
+    Args:
+        data (dict): Data to initialize the FrozenFlexDict with.
+    """
+
+    __slots__ = ('_hash',)
+
+    def __init__(self, data=None):
+        super(FrozenFlexDict, self).__init__()
+        self._ctx.set_lock(True)
+        self._hash = None
+        if data:
+            if not isinstance(data, dict):
+                raise ValueError(
+                    'FlexDict can only be initialized with instances of dict!'
+                )
+            dict.update(self, FlexDict(data).freeze())
+
+    def __setstate__(self, state):
+        flex = FlexDict()
+        flex.__setstate__(state)
+        dict.update(self, flex.freeze())
+
+    def __hash__(self):
+        if self._hash is None:
+            stack, nodes = [self], []
+            while stack:
+                node = stack.pop()
+                nodes.append(node)
+                stack.extend(
+                    value for value in node.values()
+                    if isinstance(value, FrozenFlexDict)
+                    and value._hash is None
+                )
+            for node in reversed(nodes):
+                node._hash = hash(frozenset(dict.items(node)))
+        return self._hash
+
+    def __immutable(self, *args, **kwargs):
+        raise TypeError(
+            '\'{}\' object is immutable'.format(type(self).__name__)
+        )
+
+    __setitem__ = __delitem__ = __immutable
+    set = set_many = pop = prune = lock = unlock = __immutable
+    merge = merge_many = __immutable
+    clear = update = setdefault = popitem = __ior__ = __immutable
+    build_index = create_index = enable_journal = __immutable
+    probing = property(FlexDict.probing.fget, __immutable)
+
+    @property
+    def locked(self):
+        return True
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Decodes a FrozenFlexDict encoded via `to_bytes`.
+
+        Args:
+            data (bytes): The encoded dictionary.
+
+        Returns:
+            FrozenFlexDict: The decoded dictionary.
+        """
+        return FlexDict.from_bytes(data).freeze()
+
+    @classmethod
+    def from_dict(cls, data, copy=True):
+        """
+        Creates a FrozenFlexDict from a nested dictionary.
+
+        Args:
+            data (dict): Nested dictionary to convert.
+            copy (bool): Returns `data` itself if it is already frozen.
+
+        Returns:
+            FrozenFlexDict: The converted dictionary.
+        """
+        if not copy and isinstance(data, cls):
+            return data
+        return cls(data)
+
+    @classmethod
+    def from_flat(cls, items, sep=None):
+        """
+        Creates a FrozenFlexDict from flattened items.
+
+        Args:
+            items (iterable): Pairs of key-paths and values.
+            sep (str): Splits string key-paths with `sep` if provided.
+
+        Returns:
+            FrozenFlexDict: The unflattened dictionary.
+        """
+        return FlexDict.from_flat(items, sep).freeze()
+
+    @classmethod
+    def load_stream(cls, fp, select=None):
+        """
+        Loads a JSON document into a FrozenFlexDict.
+
+        Args:
+            fp (file): File object to read the JSON document from.
+            select (iterable): Key(s) of the subtrees to load.
+
+        Returns:
+            FrozenFlexDict: The loaded document.
+        """
+        return FlexDict.load_stream(fp, select).freeze()
+
+    @classmethod
+    def iter_jsonl(cls, fp, select=None):
+        """
+        Loads JSON Lines records into FrozenFlexDicts, one at a time.
+
+        Args:
+            fp (file): File object to read the records from.
+            select (iterable): Key(s) of the subtrees to load from each record.
+
+        Yields:
+            FrozenFlexDict: The loaded records.
+        """
+        for record in FlexDict.iter_jsonl(fp, select):
+            yield record.freeze()
+
+    def freeze(self):
+        """
+        Returns the snapshot itself since it is already frozen.
+
+        Returns:
+            FrozenFlexDict: `self`.
+        """
+        return self
+
+
+def _exclusive(method):
+    """Runs `method` while no other thread mutates the dictionary."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._ctx.guard.exclusive():  # pylint: disable=W0212
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class ConcurrentFlexDict(FlexDict):
+    """
+    Thread-safe FlexDict.
+
+    Reads never take a lock and never create nested dictionaries; reading a
+    missing key raises `KeyError` whether the dictionary is locked or not,
+    or gets `MISSING` in probe mode.
+    Values are set, incremented and deleted atomically while holding only
+    one of the `stripes` locks, so mutations of different values rarely
+    wait for each other. Operations spanning the whole dictionary, such as
+    `flatten`, `freeze` or `merge`, wait for the ongoing mutations and run
+    while no other thread modifies it, so they see a consistent state. Lazy
+    iterators like `iterflatten` are not guarded; iterate over a `freeze`
+    snapshot instead.
+
+    Args:
+        data (dict): Data to initialize the ConcurrentFlexDict with.
+        stripes (int): Number of locks guarding the values.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, data=None, stripes=64):
+        super(ConcurrentFlexDict, self).__init__(data)
+        self._ctx.guard = _Guard(stripes)
+
+    @property
+    def locked(self):
+        return self._ctx.locked
+
+    @locked.setter
+    def locked(self, value):
+        if value:
+            self.lock()
+        else:
+            self.unlock()
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            if self._ctx.probing:
+                return MISSING
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, val):
+        self.set(key, val)
+
+    def __delitem__(self, key):
+        path = _as_path(key)
+        guard = self._ctx.guard
+        with guard.mutating():
+            node = self
+            for step in path[:-1]:
+                node = dict.__getitem__(node, step) if isinstance(
+                    node, dict
+                ) else node[step]
+            with guard.stripe(node, path[-1]):
+                if isinstance(node, FlexDict):
+                    FlexDict._remove(node, path[-1])
+                else:
+                    del node[path[-1]]
+
+    def set(self, keys, value, overwrite=True, increment=False, merge=None):
+        """
+        Atomically sets a dictionary value with the given keys.
+
+        Takes the same arguments as `FlexDict.set`; the existing value is
+        read and replaced while holding the lock of the value, which makes
+        increments and merges safe.
+        """
+        path = _as_path(keys)
+        if not path:
+            raise ValueError('Key-paths cannot be empty!')
+        guard = self._ctx.guard
+        with guard.mutating():
+            node = self
+            for step in path[:-1]:
+                if isinstance(node, FlexDict):
+                    child = dict.get(node, step, _MISSING)
+                    if child is _MISSING:
+                        with guard.stripe(node, step):
+                            child = FlexDict._child(node, step)
+                    node = child
+                else:
+                    node = node[step]
+            with guard.stripe(node, path[-1]):
+                if isinstance(node, FlexDict):
+                    return FlexDict.set(
+                        node, [path[-1]], value, overwrite, increment, merge
+                    )
+                return FlexDict.set(
+                    self, list(path), value, overwrite, increment, merge
+                )
+
+    def set_many(self, items, increment=False):
+        """
+        Sets multiple dictionary values at once, atomically.
+
+        Args:
+            items (Union[dict, iterable]):
+                Mapping or pairs of key(s) and values to set.
+            increment (bool):
+                Increments the values by the given ones if set to `True`.
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        with self._ctx.guard.exclusive():
+            for keys, value in items:
+                self.set(keys, value, increment=increment)
+
+    probing = property(
+        FlexDict.probing.fget, _exclusive(FlexDict.probing.fset)
+    )
+    __eq__ = _exclusive(FlexDict.__eq__)
+    __ne__ = _exclusive(FlexDict.__ne__)
+    __reduce__ = _exclusive(FlexDict.__reduce__)
+    to_bytes = _exclusive(FlexDict.to_bytes)
+    flatten = _exclusive(FlexDict.flatten)
+    freeze = _exclusive(FlexDict.freeze)
+    keys = _exclusive(FlexDict.keys)
+    values = _exclusive(FlexDict.values)
+    length = _exclusive(FlexDict.length)
+    size = _exclusive(FlexDict.size)
+    contains = _exclusive(FlexDict.contains)
+    inside = _exclusive(FlexDict.inside)
+    diff = _exclusive(FlexDict.diff)
+    merge = _exclusive(FlexDict.merge)
+    apply_patch = _exclusive(FlexDict.apply_patch)
+    pop = _exclusive(FlexDict.pop)
+    prune = _exclusive(FlexDict.prune)
+    write_csv = _exclusive(FlexDict.write_csv)
+    write_jsonl = _exclusive(FlexDict.write_jsonl)
+    write_mapped = _exclusive(FlexDict.write_mapped)
+    lock = _exclusive(FlexDict.lock)
+    unlock = _exclusive(FlexDict.unlock)
+    build_index = _exclusive(FlexDict.build_index)
+    drop_index = _exclusive(FlexDict.drop_index)
+    create_index = _exclusive(FlexDict.create_index)
+    find = _exclusive(FlexDict.find)
+    query = _exclusive(FlexDict.query)
+    enable_journal = _exclusive(FlexDict.enable_journal)
+    disable_journal = _exclusive(FlexDict.disable_journal)
+    changes = _exclusive(FlexDict.changes)
+
+
+def _evicting(method):
+    """Evicts leaves from the cache once `method` has run."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._evict()  # pylint: disable=W0212
+        return result
+    return wrapper
+
+
+class CachedFlexDict(FlexDict):
+    """
+    FlexDict bounded as a cache of its leaf values.
+
+    Reading a missing key raises `KeyError` (or gets `MISSING` in probe
+    mode) instead of creating a nested dictionary, whether the cache is
+    locked or not. Every leaf counts as
+    `weigh(value)` towards `maxsize`; once it is exceeded, the least
+    recently used leaves are evicted. Leaves also expire `ttl` seconds after
+    they are set. Nested dictionaries emptied by evictions are removed.
+
+    Leaves are evicted as the cache is modified, and expired ones as they
+    are read, in constant amortized time; the cache is never traversed.
+    Only getting items, via `[]` or `get`, uses them and counts as a hit or
+    a miss. Leaves set otherwise than through FlexDict methods are not
+    tracked. Caches created by the class methods, like `from_flat`, are
+    unbounded; unpickled caches keep their bounds, but their leaves start
+    over as if they were just set.
+
+    Args:
+        data (dict): Data to initialize the CachedFlexDict with.
+        maxsize (Union[int, float]):
+            Maximum total weight of the leaves. Unbounded if `None`.
+        ttl (float): Seconds the leaves live for. Forever if `None`.
+        weigh (callable):
+            Gets the weight of a leaf value, e.g. `sys.getsizeof` to bound
+            the cache in bytes. Every leaf weighs 1 if `None`.
+        timer (callable): Gets the current time in seconds.
+
+    Attributes:
+        hits (int): Number of items got from the cache.
+        misses (int): Number of items missing from the cache when got.
+        evictions (int): Number of leaves evicted from the cache.
+        weight (Union[int, float]): Total weight of the leaves.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, data=None, maxsize=None, ttl=None, weigh=None,
+                 timer=time):
+        super(CachedFlexDict, self).__init__(data)
+        self._ctx.tracker = _Tracker(self)
+        self._ctx.tracker.observe(
+            'cache', _Cache(maxsize, ttl, weigh, timer), self
+        )
+        self._evict()
+
+    def __reduce__(self):
+        cache = self.__cache()
+        return _restore, (
+            self.__class__, cache.maxsize, cache.ttl, cache.weigh, cache.timer
+        ), _parts(self)
+
+    def __setstate__(self, state):
+        FlexDict.__setstate__(self, state)
+        tracker = self._ctx.tracker
+        tracker.observe('cache', tracker.observers['cache'], self)
+        self._evict()
+
+    @property
+    def hits(self):
+        """Number of items got from the cache."""
+        return self.__cache().hits
+
+    @property
+    def misses(self):
+        """Number of items missing from the cache when got."""
+        return self.__cache().misses
+
+    @property
+    def evictions(self):
+        """Number of leaves evicted from the cache."""
+        return self.__cache().evictions
+
+    @property
+    def weight(self):
+        """Total weight of the leaves."""
+        return self.__cache().weight
+
+    def __getitem__(self, key):
+        value = self.__lookup(key)
+        if value is _MISSING:
+            if self._ctx.probing:
+                return MISSING
+            raise KeyError(key)
+        return value
+
+    def __context(self):
+        """Gets the context of the tree holding the cache of `self`."""
+        ctx = self._ctx
+        while ctx.tracker is None or 'cache' not in ctx.tracker.observers:
+            ctx = ctx.parent
+        return ctx
+
+    def __cache(self):
+        return self.__context().tracker.observers['cache']
+
+    def __lookup(self, keys, probe=False):
+        """
+        Gets a value, or `_MISSING`, using the leaf it is part of. Only
+        follows dictionaries if `probe` is `True`.
+        """
+        keys = _sanitize(keys)
+        node, leaf = self, None
+        for key in keys if isinstance(keys, (list, KeyPath)) else (keys,):
+            if isinstance(node, dict):
+                parent, node = node, dict.get(node, key, _MISSING)
+                if leaf is None and not isinstance(node, dict):
+                    leaf = parent, key
+            elif not probe and key in node:
+                node = node[key]
+            else:
+                node = _MISSING
+            if node is _MISSING:
+                break
+        cache = self.__cache()
+        if node is not _MISSING and leaf is not None and not cache.touch(
+                *leaf
+        ):
+            self._evict()
+            node = _MISSING
+        if node is _MISSING:
+            cache.misses += 1
+        else:
+            cache.hits += 1
+        return node
+
+    def _evict(self):
+        """Evicts leaves until the cache is back within its bounds."""
+        ctx = self.__context()
+        cache, paths, root = (
+            ctx.tracker.observers['cache'], ctx.tracker.paths, ctx.owner()
+        )
+        victim = cache.victim()
+        while victim is not None:
+            node, key = victim
+            FlexDict._remove(node, key)
+            cache.evictions += 1
+            path = paths.get(id(node), ())
+            while path and not node:
+                parent = FlexDict.get(root, path[:-1])
+                FlexDict._remove(parent, path[-1])
+                node, path = parent, path[:-1]
+            victim = cache.victim()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Decodes an unbounded CachedFlexDict encoded via `to_bytes`.
+
+        Args:
+            data (bytes): The encoded dictionary.
+
+        Returns:
+            CachedFlexDict: The decoded dictionary.
+        """
+        return super(CachedFlexDict, cls).from_bytes(data)
+
+    @classmethod
+    def from_dict(cls, data, copy=True):
+        """
+        Creates an unbounded CachedFlexDict from a nested dictionary.
+
+        Args:
+            data (dict): Nested dictionary to convert.
+            copy (bool):
+                Returns `data` itself if it is already a `CachedFlexDict`.
+                Other dictionaries are always copied, so that the cache
+                tracks their leaves.
+
+        Returns:
+            CachedFlexDict: The converted dictionary.
+        """
+        if not copy and isinstance(data, cls):
+            return data
+        return cls.__track(FlexDict.from_dict(data))
+
+    @classmethod
+    def from_flat(cls, items, sep=None):
+        """
+        Creates an unbounded CachedFlexDict from flattened items.
+
+        Args:
+            items (iterable): Pairs of key-paths and values.
+            sep (str): Splits string key-paths with `sep` if provided.
+
+        Returns:
+            CachedFlexDict: The unflattened dictionary.
+        """
+        return cls.__track(FlexDict.from_flat(items, sep))
+
+    @classmethod
+    def load_stream(cls, fp, select=None):
+        """
+        Loads a JSON document into an unbounded CachedFlexDict.
+
+        Args:
+            fp (file): File object to read the JSON document from.
+            select (iterable): Key(s) of the subtrees to load.
+
+        Returns:
+            CachedFlexDict: The loaded document.
+        """
+        return cls.__track(FlexDict.load_stream(fp, select))
+
+    @classmethod
+    def iter_jsonl(cls, fp, select=None):
+        """
+        Loads JSON Lines records into unbounded CachedFlexDicts.
+
+        Args:
+            fp (file): File object to read the records from.
+            select (iterable): Key(s) of the subtrees to load from each record.
+
+        Yields:
+            CachedFlexDict: The loaded records.
+        """
+        for record in FlexDict.iter_jsonl(fp, select):
+            yield cls.__track(record)
+
+    @classmethod
+    def __track(cls, flex):
+        """Copies a FlexDict into a new cache, lock state included."""
+        cached = cls(flex)
+        cached.locked = flex.locked
+        return cached
+
+    def get(self, keys, default=None):
+        """
+        Gets a value from the cache with the provided keys.
+
+        Args:
+            keys: Keys pointing to the target value.
+            default (any): Default value to return if target does not exists.
+
+        Returns:
+            any: The corresponding dictionary value.
+        """
+        value = self.__lookup(keys)
+        return default if value is _MISSING else value
+
+    def probe(self, keys):
+        """
+        Gets a value from the cache like `FlexDict.probe`, as a hit or a
+        miss.
+
+        Args:
+            keys: Keys pointing to the target value.
+
+        Returns:
+            any: The corresponding dictionary value or `MISSING`.
+        """
+        value = self.__lookup(keys, probe=True)
+        return MISSING if value is _MISSING else value
+
+    __setitem__ = _evicting(FlexDict.__setitem__)
+    set = _evicting(FlexDict.set)
+    set_many = _evicting(FlexDict.set_many)
+    merge = _evicting(FlexDict.merge)
+    merge_many = _evicting(FlexDict.merge_many)
+    apply_patch = _evicting(FlexDict.apply_patch)
 
-class FlexDict(dict):
+
+class _MappedFile(object):
+    """Memory map and key table shared by the nodes of a MappedFlexDict."""
+
+    __slots__ = ('path', 'buffer', 'table', 'keys', 'root', 'locked')
+
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        end = len(buffer) - _TRAILER.size
+        if end < len(_MAPPED) or buffer[:len(_MAPPED)] != _MAPPED:
+            buffer.close()
+            raise ValueError('File is not written by FlexDict.write_mapped!')
+        flags, start, self.root = _TRAILER.unpack_from(buffer, end)
+        self.path, self.buffer, self.locked = path, buffer, bool(
+            flags & _LOCKED
+        )
+        self.table = pickle.loads(buffer[start:end])  # nosec
+        self.keys = {}
+        for index, key in enumerate(self.table):
+            self.keys.setdefault(key, []).append(index)
+
+
+class MappedFlexDict(object):
     """
-    Provides automatic and arbitrary levels of
-    nesting along with additional utility methods.
+    Read-only FlexDict backed by a file written via `FlexDict.write_mapped`.
 
-    Args:
-        data (dict): Data to initialize the FlexDict with.
+    The file is memory-mapped and only its key table is loaded when opened.
+    Nested dictionaries are read on access, as `MappedFlexDict` views of
+    the same file, and values are unpickled when they are read. Processes
+    mapping the same file share its pages, so only the touched parts of
+    the data are ever loaded into memory. Values are not cached; read them
+    once or `materialize` the subtrees read over and over.
 
-    Attributes:
-        locked (bool): Flag indicating if auto-nesting is locked.
+    Pickled values are unpickled, so only open files from trusted sources.
+
+    Args:
+        path (str): Path of the file to open.
     """
 
-    def __init__(self, data=None):
-        super(FlexDict, self).__init__()
-        self.locked = False
-        if data:
-            if isinstance(data, dict):
-                for items in self.__kv(data):
-                    self.__setitem__(*items)
-            else:
-                raise ValueError(
-                    'FlexDict can only be initialized with instances of dict!'
-                )
+    # Views of the same file read each other's offsets and helpers.
+    # pylint: disable=W0212
+
+    __slots__ = ('_file', '_offset')
+
+    def __init__(self, path):
+        self._file = _MappedFile(path)
+        self._offset = self._file.root
+
+    def __reduce__(self):
+        return _reopen, (self._file.path, self._offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return 'MappedFlexDict({!r})'.format(self.materialize())
 
     def __hash__(self):
         return id(self)
 
     def __eq__(self, other):
-        if isinstance(other, dict):
-            return self.flatten() == FlexDict(other).flatten()
-        return False
+        if isinstance(other, MappedFlexDict):
+            if other._file is self._file:
+                return other._offset == self._offset
+            other = other.materialize()
+        return isinstance(other, dict) and self.__equals(other)
 
-    def __getitem__(self, key):
-        key = self.__sanitize(key)
-        if isinstance(key, list):
-            for _, k in enumerate(key, start=1):
-                self = self[k]
-            return self
-        try:
-            return dict.__getitem__(self, key)
-        except KeyError:
-            if not self.locked:
-                return self.setdefault(key, FlexDict())
-            raise
+    def __ne__(self, other):
+        return not self == other
 
-    def __setitem__(self, key, val):
-        key = self.__sanitize(key)
-        if isinstance(key, list):
-            for i, k in enumerate(key[:-1], start=1):
-                if not self.locked or k in self:
-                    self = self[k]
-                else:
-                    if i == len(key) - 1:
-                        raise KeyError(k)
-            self[key[-1]] = val
-        else:
-            dict.__setitem__(
-                self, key, FlexDict(val) if isinstance(val, dict) else val
-            )
+    def __len__(self):
+        return _COUNT.unpack_from(self._file.buffer, self._offset)[0]
 
-    @staticmethod
-    def __sanitize(key):
-        if isinstance(key, (list, set, tuple)):
-            return list(key)
-        if isinstance(key, dict):
-            raise TypeError('unhashable type: \'dict\'')
-        return key
+    def __iter__(self):
+        table = self._file.table
+        return iter([table[tag >> 1] for tag, _ in self.__entries()])
 
-    def __kv(self, data, results=None):
-        if results is None:
-            results = []
-        for key, value in data.items():
-            if isinstance(value, dict) and value:
-                for item in self.__kv(value, results + [key]):
-                    yield item
-            else:
-                yield results + [key], value
+    def __contains__(self, key):
+        return self.__find(key) is not _MISSING
 
-    def __k(self, data):
-        for key, value in data.items():
-            if isinstance(value, dict):
-                yield key
-                for nested_key in self.__k(value):
-                    yield nested_key
+    def __getitem__(self, key):
+        key = _sanitize(key)
+        node = self
+        for step in key if isinstance(key, (list, KeyPath)) else (key,):
+            if isinstance(node, MappedFlexDict):
+                entry = node.__find(step)
+                if entry is _MISSING:
+                    raise KeyError(step)
+                node = node.__value(*entry)
             else:
-                yield key
+                node = node[step]
+        return node
 
-    def __v(self, data):
-        for _, value in data.items():
-            if isinstance(value, dict) and value:
-                for nested_value in self.__v(value):
-                    yield nested_value
+    def __entries(self, offset=None):
+        """Reads the entries of the node at `offset` in insertion order."""
+        buffer = self._file.buffer
+        offset = self._offset if offset is None else offset
+        start = offset + _COUNT.size
+        return [
+            _ENTRY.unpack_from(buffer, start + i * _ENTRY.size)
+            for i in range(_COUNT.unpack_from(buffer, offset)[0])
+        ]
+
+    def __find(self, key):
+        """Binary searches the entry of `key`, among its sorted positions."""
+        indices = self._file.keys.get(key)
+        if indices is None:
+            return _MISSING
+        buffer, offset = self._file.buffer, self._offset
+        length = _COUNT.unpack_from(buffer, offset)[0]
+        start = offset + _COUNT.size
+        slots = start + length * _ENTRY.size
+        for index in indices:
+            low, high = 0, length
+            while low < high:
+                middle = (low + high) // 2
+                found, position = _SLOT.unpack_from(
+                    buffer, slots + middle * _SLOT.size
+                )
+                if found == index:
+                    return _ENTRY.unpack_from(
+                        buffer, start + position * _ENTRY.size
+                    )
+                if found < index:
+                    low = middle + 1
+                else:
+                    high = middle
+        return _MISSING
+
+    def __value(self, tag, offset):
+        """Reads the value of an entry; nested nodes are returned as views."""
+        if tag & 1:
+            view = MappedFlexDict.__new__(MappedFlexDict)
+            view._file, view._offset = self._file, offset
+            return view
+        buffer = self._file.buffer
+        start = offset + _COUNT.size
+        end = start + _COUNT.unpack_from(buffer, offset)[0]
+        return pickle.loads(buffer[start:end])  # nosec
+
+    def __walk(self, leaves=False):
+        """
+        Traverses the nested nodes depth-first, in the order of
+        `FlexDict.keys(nested=True)`, without reading any value.
+
+        Yields `(key, tag, offset, branch)` tuples of the entries. Branches
+        are not yielded if `leaves` is `True`.
+        """
+        table = self._file.table
+        stack = [iter(self.__entries())]
+        while stack:
+            for tag, offset in stack[-1]:
+                entries = self.__entries(offset) if tag & 1 else None
+                if entries:
+                    if not leaves:
+                        yield table[tag >> 1], tag, offset, True
+                    stack.append(iter(entries))
+                    break
+                yield table[tag >> 1], tag, offset, False
             else:
-                yield value
+                stack.pop()
 
-    def __lock(self, lock, inplace, data=None):
-        if not data:
-            data = self if inplace else FlexDict(self)
-        data.locked = lock
-        for key, val in data.items():
-            if isinstance(val, FlexDict):
-                data[key].locked = lock
-                self.__lock(lock, inplace, data[key])
-        return None if inplace else data
+    def __equals(self, other):
+        """Compares the node with a dictionary, reading only what differs."""
+        stack = [(self, other)]
+        while stack:
+            node, other = stack.pop()
+            if len(node) != len(other):
+                return False
+            for key, value in other.items():
+                entry = node.__find(key)
+                if entry is _MISSING or bool(entry[0] & 1) != isinstance(
+                        value, dict
+                ):
+                    return False
+                current = node.__value(*entry)
+                if isinstance(value, dict):
+                    stack.append((current, value))
+                elif not (current is value or current == value):
+                    return False
+        return True
 
-    def __contains(self, superset, subset, dicts):
-        if superset == subset:
-            return True
-        if dicts:
-            superset = {
-                key: value
-                for sub_dict in dicts
-                for key, value in sub_dict.items()
-            }
-            dicts = []
-        for sub_key, sub_val in subset.items():
-            for sup_key, sup_value in superset.items():
-                if {sup_key: sup_value} == {sub_key: sub_val}:
-                    return True
-                if isinstance(sup_value, dict):
-                    if sup_value == subset:
-                        return True
-                    dicts.append(sup_value)
-            if dicts:
-                return self.__contains(superset, subset, dicts)
-        return False
+    def __holds(self, subset):
+        for key, value in subset.items():
+            entry = self.__find(key)
+            if entry is _MISSING or not self.__value(*entry) == value:
+                return False
+        return True
 
     def get(self, keys, default=None):
         """
@@ -147,65 +3318,39 @@ class FlexDict(dict):
         Returns:
             any: The corresponding dictionary value.
         """
-        keys = self.__sanitize(keys)
-        if isinstance(keys, list):
-            for key in keys:
-                if key in self:
-                    self = self[key]
-                else:
+        keys = _sanitize(keys)
+        node = self
+        for key in keys if isinstance(keys, (list, KeyPath)) else (keys,):
+            if isinstance(node, MappedFlexDict):
+                entry = node.__find(key)
+                if entry is _MISSING:
                     return default
-            return self
-        if keys in self:
-            return self[keys]
-        return default
-
-    def set(self, keys, value, overwrite=True, increment=False):
-        """
-        Sets a dictionary value with the given keys.
-
-        Args:
-            keys (any): Key(s) pointing to the value.
-            value (any): Value to set.
-            overwrite (bool): If `False`, only sets a value if it not exists.
-            increment (bool):
-                Increments the value by `value` if set to `True`.
-                `overwrite` argument has no effect on this.
-                Causes the method to return the target value.
-
-        Returns:
-            Union[int, float, None]:
-                Final state of the target value if `increment` is enabled.
-        """
-        keys = self.__sanitize(keys)
-        if not increment:
-            if overwrite or keys[-1] in self.get(keys[:-1], default=[]):
-                self[keys] = value
-            return None
-        self[keys] = value if (
-            not self[keys]
-        ) else self[keys] + value
-        return self[keys]
+                node = node.__value(*entry)
+            elif key in node:
+                node = node[key]
+            else:
+                return default
+        return node
 
     def keys(self, nested=False, unique=False):
         """
-        Gets keys from the dictionary.
+        Gets keys from the dictionary, without reading any value.
 
         Args:
             nested (bool): Gets all keys recursively if set to `True`.
             unique (bool): Gets only the unique keys if set to `True`.
 
         Returns:
-            Union[dict_keys, list, set]:
-                dict_keys
-                    If `nested` is `False` and `unique` is `False`.
+            Union[list, set]:
                 list
-                    If `nested` is `True` and `unique` is `False`.
+                    If `unique` is `False`.
                 set
                     If `unique` is `True`.
         """
-        return dict.keys(self) if not nested else (
-            list(self.__k(self)) if not unique else set(self.__k(self))
-        )
+        keys = list(self) if not nested else [
+            key for key, _, _, _ in self.__walk()
+        ]
+        return set(keys) if unique else keys
 
     def values(self, nested=False, unique=False):
         """
@@ -216,19 +3361,18 @@ class FlexDict(dict):
             unique (bool): Gets only the unique values if set to `True`.
 
         Returns:
-            Union[dict_values list, set]:
-                dict_values
-                    If `nested` is `False` and `unique` is `False`.
-                list:
-                    If `nested` is `True` and `unique` is `False`.
-                list:
-                    If `unique` is `True`.
+            Union[list, set]:
+                list
+                    If `unique` is `False` or `nested` is `False`.
+                set
+                    If `unique` is `True` and `nested` is `True`.
         """
-        vals = (
-            list(dict.values(self))
-            if not nested
-            else list(self.__v(self))
-        )
+        vals = [self.__value(*entry) for entry in self.__entries()] if (
+            not nested
+        ) else [
+            self.__value(tag, offset)
+            for _, tag, offset, _ in self.__walk(leaves=True)
+        ]
         return (
             vals
             if not unique
@@ -237,112 +3381,121 @@ class FlexDict(dict):
             else set(vals)
         )
 
-    def pop(self):
+    def items(self):
         """
-        Removes and returns the last key-value pair from the dictionary.
+        Gets the items of the dictionary.
 
         Returns:
-            Union[FlexDict, None]:
-                FlexDict
-                    The last key-value pair of the dictionary.
-                None
-                    If `self` is empty.
+            list: Key-value pairs, nested dictionaries being views.
         """
-        if self:
-            key, val = list(self.items())[-1]
-            del self[key]
-            return FlexDict({key: val})
-        return None
+        table = self._file.table
+        return [
+            (table[tag >> 1], self.__value(tag, offset))
+            for tag, offset in self.__entries()
+        ]
 
-    def length(self, nested=False, unique=False):
+    def contains(self, subset):
         """
-        Counts the number of keys inside the dictionary.
+        Checks if this dictionary is a superset of a given one.
 
         Args:
-            nested (bool): Counts all keys recursively if set to `True`.
-            unique (bool): Counts only the unique keys if set to `True`.
+            subset (dict): Dictionary to check if it is a subset.
 
         Returns:
-            int: Number of keys.
+            bool: `True` if `self` contains `subset` else `False`.
         """
-        return len(self.keys(nested=nested, unique=unique))
+        if not subset:
+            return not len(self)
+        if self.__holds(subset):
+            return True
+        return any(
+            self.__value(tag, offset).__holds(subset)
+            for _, tag, offset, branch in self.__walk() if branch
+        )
 
-    def size(self, unique=False):
+    def materialize(self):
         """
-        Counts the number of keys and values inside the dictionary.
-
-        Args:
-            nested (bool): Counts all items recursively if set to `True`.
-            unique (bool): Counts only the unique items if set to `True`.
+        Loads the dictionary into memory.
 
         Returns:
-            int: Number of items.
+            FlexDict: The loaded dictionary, locked if it was when written.
         """
-        return len(self.keys(nested=True, unique=unique)) + len(
-            self.values(nested=True, unique=unique)
-        )
+        flex = FlexDict()
+        table, setitem = self._file.table, dict.__setitem__
+        stack = [(flex, self._offset)]
+        while stack:
+            node, offset = stack.pop()
+            for tag, position in self.__entries(offset):
+                if tag & 1:
+                    value = FlexDict.__new__(FlexDict)
+                    value._ctx = flex._ctx
+                    stack.append((value, position))
+                else:
+                    value = self.__value(tag, position)
+                setitem(node, table[tag >> 1], value)
+        if self._file.locked:
+            flex.lock()
+        return flex
 
-    def flatten(self):
-        """
-        Flattens the dictionary.
+    def close(self):
+        """Closes the file, which invalidates every view of it."""
+        self._file.buffer.close()
 
-        Returns:
-            list: A list of tuples containing key-paths and values.
-        """
-        return list(self.__kv(self))
 
-    def lock(self, inplace=True):
-        """
-        Locks the automatic nesting mechanism.
+def _aggregate(task):
+    """Sums a chunk of records into a FlexDict; a worker of `aggregate`."""
+    cls, mapper, records = task
+    flex = cls()
+    if mapper is not None:
+        records = (pair for record in records for pair in mapper(record))
+    flex.set_many(records, increment=True)
+    return flex
 
-        Args:
-            inplace (bool): Creates a locked copy if `True`.
 
-        Returns:
-            Union[None, FlexDict]:
-                None
-                    If `inplace` is set to `True`.
-                FlexDict
-                    If `inplace`set to `False`.
-        """
-        return self.__lock(True, inplace)
+def _merge_sum(pair):
+    """Sums two partial results; a worker of `aggregate`."""
+    first, second = pair
+    first.merge(second, strategy='sum', copy=False)
+    return first
 
-    def unlock(self, inplace=True):
-        """
-        Unlocks the automatic nesting mechanism.
 
-        Args:
-            inplace (bool): Creates an unlocked copy if `True`.
+def _restore(cls, *args):
+    """Creates an empty FlexDict for unpickling, with `args` as settings."""
+    return cls(None, *args)
 
-        Returns:
-            Union[None, FlexDict]:
-                None
-                    If `inplace` is set to `True`.
-                FlexDict
-                    If `inplace`set to `False`.
-        """
-        return self.__lock(False, inplace)
 
-    def contains(self, subset):
-        """
-        Checks if this dictionary is a superset of a given one.
+def _reopen(path, offset):
+    """Reopens a pickled MappedFlexDict."""
+    mapped = MappedFlexDict(path)
+    mapped._offset = offset  # pylint: disable=W0212
+    return mapped
 
-        Args:
-            subset (dict): Dictionary to check if it is a subset.
 
-        Returns:
-            bool: `True` if `self` contains `subset` else `False`.
-        """
-        return self.__contains(self, subset, [])
+def dumps(data):
+    """
+    Encodes a (nested) dictionary into the compact binary format of FlexDict.
 
-    def inside(self, superset):
-        """
-        Checks if this dictionary is a subset of a given one.
+    Args:
+        data (dict): Dictionary to encode.
 
-        Args:
-            superset (dict): Dictionary to check if it is a superset.
+    Returns:
+        bytes: The encoded dictionary.
+    """
+    if isinstance(data, FlexDict):
+        return data.to_bytes()
+    if not isinstance(data, dict):
+        raise ValueError('Only instances of dict can be encoded!')
+    return _encode(data)
 
-        Returns:
-            bool: `True` if `self` is inside the `superset` else `False`.
-        """
-        return self.__contains(superset, self, [])
+
+def loads(data):
+    """
+    Decodes a FlexDict encoded via `dumps` or `FlexDict.to_bytes`.
+
+    Args:
+        data (bytes): The encoded dictionary.
+
+    Returns:
+        FlexDict: The decoded dictionary.
+    """
+    return FlexDict.from_bytes(data)
@@ -14,7 +14,10 @@ setup(
     long_description=long_description,
     long_description_content_type='text/markdown',
     url='https://github.com/ozturkberkay/flexdict',
-    packages=find_packages(exclude=('tests',)),
+    packages=find_packages(exclude=('tests', 'benchmarks')),
+    extras_require={
+        'numpy': ['numpy'],
+    },
     classifiers=[
         'Development Status :: 1 - Planning',
         'Intended Audience :: Developers',
@@ -1,7 +1,25 @@
 """Unit tests for FlexDict."""
 
-from pytest import mark, raises
-from flexdict import FlexDict
+# The tests of the whole single-module package live in this file.
+# pylint: disable=C0302
+
+from io import StringIO
+from json import dumps as json_dumps
+from operator import add
+from pickle import dumps, loads
+from threading import Thread
+
+from pytest import importorskip, mark, raises
+from flexdict import (
+    MISSING, CachedFlexDict, ConcurrentFlexDict, FlexDict, FrozenFlexDict,
+    KeyPath, MappedFlexDict, Query
+)
+from flexdict import dumps as flex_dumps, loads as flex_loads
+
+try:
+    from StringIO import StringIO as NativeIO  # Buffers of str on Python 2.
+except ImportError:
+    NativeIO = StringIO
 
 DATA = {'a': {'b': {'c': 1, 'd': 2}}, 'e': {'f': 3, 'g': 4}, 'h': 5}
 
@@ -134,6 +152,30 @@ def test_set_func_overwrite_false():
     assert res is None
 
 
+def test_set_func_overwrite_false_nested():
+    """Setting nested values without overwriting existing ones."""
+    flex = FlexDict({'a': {'b': 1}})
+    flex.set(['a', 'b'], 2, overwrite=False)
+    flex.set(['a', 'c'], 2, overwrite=False)
+    flex.set(['d', 'e'], 3, overwrite=False)
+    assert flex == {'a': {'b': 1, 'c': 2}, 'd': {'e': 3}}
+
+
+@mark.parametrize('merge, values, result', [
+    (max, [3, 1, 5, 2], 5),
+    (min, [3, 1, 5, 2], 1),
+    (add, [1, 2, 3], 6),
+    (add, [[1], [2]], [1, 2]),
+])
+def test_set_func_merge(merge, values, result):
+    """Setting values with a merge function."""
+    flex = FlexDict()
+    for value in values:
+        res = flex.set(['a', 'b'], value, merge=merge)
+    assert res == result
+    assert flex['a', 'b'] == result
+
+
 def test_set_func_value_error():
     """Invalid argument for set()."""
     flex = FlexDict()
@@ -141,6 +183,60 @@ def test_set_func_value_error():
         flex.set({'a': 1}, 1)
 
 
+@mark.parametrize('strategy, result', [
+    ('override', {'a': {'b': {'c': 10, 'd': 2, 'x': 1}}, 'e': 6, 'h': 7}),
+    ('keep', {'a': {'b': {'c': 1, 'd': 2, 'x': 1}}, 'e': {'f': 3, 'g': 4},
+              'h': 5}),
+    ('sum', {'a': {'b': {'c': 11, 'd': 2, 'x': 1}}, 'e': {'f': 3, 'g': 4},
+             'h': 12}),
+    ('append', {'a': {'b': {'c': [1, 10], 'd': 2, 'x': 1}},
+                'e': [{'f': 3, 'g': 4}, 6], 'h': [5, 7]}),
+    (max, {'a': {'b': {'c': 10, 'd': 2, 'x': 1}}, 'e': {'f': 3, 'g': 4},
+           'h': 7}),
+])
+def test_merge(strategy, result):
+    """Merging dictionaries with a strategy."""
+    flex = FlexDict(DATA)
+    other = {'a': {'b': {'c': 10, 'x': 1}}, 'h': 7}
+    if strategy not in ('sum', max):
+        other['e'] = 6
+    flex.merge(other, strategy=strategy)
+    assert flex == result
+    assert isinstance(flex['a', 'b'], FlexDict)
+
+
+def test_merge_copy():
+    """Merging dictionaries with and without copying their subtrees."""
+    other = FlexDict({'x': {'y': 1}, 'a': {'b': {'z': 2}}})
+    flex = FlexDict(DATA)
+    flex.merge(other)
+    assert flex['x'] is not other['x']
+    assert flex['a', 'b', 'z'] == 2
+    flex = FlexDict(DATA)
+    flex.merge(other, copy=False)
+    assert flex['x'] is other['x']
+    flex.lock()
+    with raises(KeyError):
+        flex['x', 'q']
+    with raises(ValueError):
+        flex.merge([1])
+    with raises(ValueError):
+        flex.merge({}, strategy='unknown')
+
+
+def test_merge_many():
+    """Merging many dictionaries in order."""
+    flex = FlexDict()
+    flex.merge_many([DATA, {'h': 1, 'a': {'b': {'c': 2}}}, {'h': 3}], 'sum')
+    assert flex == {'a': {'b': {'c': 3, 'd': 2}}, 'e': {'f': 3, 'g': 4},
+                    'h': 9}
+    flex.build_index()
+    flex.merge_many([{'e': {'f': 4}}, {'a': {'x': 5}}])
+    assert flex.contains({'f': 4, 'g': 4})
+    assert flex.contains({'x': 5})
+    assert not flex.contains({'f': 3})
+
+
 def test_keys():
     """Getting keys."""
     flex = FlexDict(DATA)
@@ -260,6 +356,67 @@ def test_pop():
     assert flex.pop() is None
 
 
+def test_delitem():
+    """Deleting nested items with key-paths."""
+    flex = FlexDict(DATA)
+    del flex['a', 'b', 'c']
+    del flex[FlexDict.path('e')]
+    del flex[['h']]
+    assert flex == {'a': {'b': {'d': 2}}}
+    with raises(KeyError):
+        del flex['x', 'y']
+    assert 'x' not in flex
+    flex = FlexDict.from_dict({('a', 'b'): 1})
+    assert flex.pop() == {('a', 'b'): 1}
+
+
+def test_diff():
+    """Comparing dictionaries item by item."""
+    flex = FlexDict(DATA)
+    other = FlexDict(DATA)
+    other['a', 'b', 'c'] = 10
+    other['a', 'x'] = {'y': 1}
+    other['e'] = 6
+    del other['h']
+    assert flex.diff(flex) == []
+    assert flex.diff(DATA) == []
+    assert sorted(flex.diff(other), key=repr) == sorted([
+        (('a', 'b', 'c'), 1, 10),
+        (('a', 'x'), MISSING, {'y': 1}),
+        (('e',), {'f': 3, 'g': 4}, 6),
+        (('h',), 5, MISSING),
+    ], key=repr)
+    assert all(isinstance(path, KeyPath) for path, _, _ in flex.diff(other))
+    with raises(ValueError):
+        flex.diff([1])
+
+
+def test_diff_snapshots():
+    """Comparing snapshots which share their unchanged subtrees."""
+    flex = FlexDict(DATA)
+    first = flex.freeze()
+    flex['e', 'f'] = 0
+    second = flex.freeze()
+    assert first['a'] is second['a']
+    assert first.diff(second) == [(('e', 'f'), 3, 0)]
+
+
+def test_apply_patch():
+    """Applying the changes between dictionaries."""
+    flex = FlexDict(DATA)
+    other = {'a': {'b': {'c': 2}, 'x': 1}, 'e': {'f': {'g': 1}}, 'i': []}
+    flex.apply_patch(flex.diff(other))
+    assert flex == other
+    assert isinstance(flex['e', 'f'], FlexDict)
+
+
+def test_missing():
+    """The sentinel of missing values."""
+    assert not MISSING
+    assert repr(MISSING) == 'MISSING'
+    assert loads(dumps(MISSING)) is MISSING
+
+
 @mark.parametrize('get_keys, get_val', [
     (['a'], DATA['a']),
     (['a', 'b'], DATA['a']['b']),
@@ -344,3 +501,1086 @@ class TestFlexDictSSet:
     def test_inside(s_set, flag):
         """Superset detection."""
         assert FlexDict(s_set).inside(DATA) is flag
+
+    @staticmethod
+    def test_contains_indexed(s_set, flag):
+        """Subset detection with an index."""
+        flex = FlexDict(DATA)
+        flex.build_index()
+        assert flex.contains(s_set) is flag
+
+    @staticmethod
+    def test_inside_indexed(s_set, flag):
+        """Superset detection with an index."""
+        flex = FlexDict(DATA)
+        flex.build_index()
+        assert FlexDict(s_set).inside(flex) is flag
+
+
+def test_flatten_deep():
+    """Flattening deeper than the recursion limit."""
+    depth = 5000
+    flex = FlexDict()
+    flex[list(range(depth))] = 1
+    assert flex.flatten() == [(list(range(depth)), 1)]
+    assert flex.keys(nested=True) == list(range(depth))
+    assert flex.values(nested=True) == [1]
+    assert flex.length(nested=True) == depth
+    assert flex.size() == depth + 1
+
+
+def test_init_copy():
+    """Initialization copies nested dictionaries."""
+    data = {'a': {'b': {'c': 1}}}
+    flex = FlexDict(data)
+    data['a']['b']['c'] = 2
+    assert flex['a', 'b', 'c'] == 1
+    assert isinstance(flex['a', 'b'], FlexDict)
+
+
+def test_from_dict():
+    """Bulk conversion of nested dictionaries."""
+    flex = FlexDict.from_dict(DATA)
+    assert flex == DATA
+    assert isinstance(flex['a', 'b'], FlexDict)
+    assert flex['a', 'b'] is not FlexDict.from_dict(flex)['a', 'b']
+
+
+def test_from_dict_adopt():
+    """Adopting FlexDict instances without copying them."""
+    nested = FlexDict({'c': 1})
+    flex = FlexDict.from_dict({'a': {'b': nested}}, copy=False)
+    assert flex['a', 'b'] is nested
+    assert FlexDict.from_dict(flex, copy=False) is flex
+
+
+def test_from_dict_value_error():
+    """Invalid argument for from_dict()."""
+    with raises(ValueError):
+        FlexDict.from_dict([1, 2])
+
+
+@mark.parametrize('other, flag', [
+    (DATA, True),
+    ({'h': 5, 'e': {'g': 4, 'f': 3}, 'a': {'b': {'d': 2, 'c': 1}}}, True),
+    ({'a': {'b': {'c': 1, 'd': 2}}, 'e': {'f': 3, 'g': 4}}, False),
+    ({'a': {'b': {'c': 1, 'd': 3}}, 'e': {'f': 3, 'g': 4}, 'h': 5}, False),
+    ({'a': {'b': 1}, 'e': {'f': 3, 'g': 4}, 'h': 5}, False),
+    ({'a': {'b': {'c': 1, 'd': 2}}, 'e': {'f': 3, 'g': 4}, 'h': {}}, False),
+    ({'a': {'b': {'c': 1, 'x': 2}}, 'e': {'f': 3, 'g': 4}, 'h': 5}, False),
+    ([], False)
+])
+def test_equals_structural(other, flag):
+    """Structural equality comparisons."""
+    flex = FlexDict(DATA)
+    assert (flex == other) is flag
+    assert (flex != other) is not flag
+
+
+def test_contains_partial_match():
+    """Subsets must be contained by a single nested dictionary."""
+    flex = FlexDict(DATA)
+    assert flex.contains({'f': 3, 'g': 0}) is False
+    assert flex.contains({'c': 1, 'f': 3}) is False
+    flex.build_index()
+    assert flex.contains({'f': 3, 'g': 0}) is False
+    assert flex.contains({'c': 1, 'f': 3}) is False
+
+
+def test_index_updates():
+    """Keeping the index up-to-date with modifications."""
+    flex = FlexDict(DATA)
+    flex.build_index()
+    flex['e', 'g'] = 0
+    assert flex.contains({'f': 3, 'g': 0}) is True
+    assert flex.contains({'g': 4}) is False
+    flex['a']['b']['x'] = {'y': 1}
+    assert flex.contains({'y': 1}) is True
+    del flex['a']
+    assert flex.contains({'y': 1}) is False
+    assert flex.contains({'c': 1}) is False
+    flex['z', 'k'] = 1
+    assert flex.contains({'k': 1}) is True
+    assert flex['z'].pop() == {'k': 1}
+    assert flex.contains({'k': 1}) is False
+    flex.drop_index()
+    assert flex.contains({'f': 3, 'g': 0}) is True
+
+
+def test_index_subtree():
+    """Indexing a nested dictionary."""
+    flex = FlexDict(DATA)
+    flex['e'].build_index()
+    assert flex['e'].contains({'c': 1}) is False
+    assert flex.contains({'c': 1}) is True
+    flex['e', 'h'] = 1
+    assert flex['e'].contains({'h': 1}) is True
+
+
+def test_journal():
+    """Recording the changes made to the dictionary."""
+    flex = FlexDict(DATA)
+    with raises(ValueError):
+        flex.changes()
+    flex.enable_journal()
+    flex['a', 'b', 'c'] = 10
+    flex.set('h', 1, increment=True)
+    del flex['e', 'f']
+    flex['e'].pop()
+    flex['x', 'y'] = 1
+    assert flex.changes() == [
+        (1, ('a', 'b', 'c'), 1, 10),
+        (2, ('h',), 5, 6),
+        (3, ('e', 'f'), 3, MISSING),
+        (4, ('e', 'g'), 4, MISSING),
+        (5, ('x',), MISSING, {}),
+        (6, ('x', 'y'), MISSING, 1),
+    ]
+    removed = flex['x']
+    del flex['x']
+    removed['z'] = 2
+    assert flex.changes(since=6) == [(7, ('x',), {'y': 1}, MISSING)]
+    assert flex.changes(since=4) == flex.changes()[4:]
+    assert flex.changes(since=7) == []
+    flex.build_index()
+    flex.drop_index()
+    assert len(flex.changes()) == 7
+    flex.disable_journal()
+    with raises(ValueError):
+        flex.changes()
+
+
+def test_journal_bounded():
+    """Discarding the oldest changes of the journal."""
+    flex = FlexDict()
+    flex['e'].enable_journal(maxlen=3)
+    for i in range(5):
+        flex['e', 'f'] = i
+    flex['a'] = 1
+    assert [change[0] for change in flex['e'].changes(since=2)] == [3, 4, 5]
+    with raises(ValueError):
+        flex['e'].changes(since=1)
+    flex['e'].enable_journal(maxlen=2)
+    assert flex['e'].changes(since=3) == [(4, ('f',), 2, 3), (5, ('f',), 3, 4)]
+
+
+def test_pickle():
+    """Pickling and unpickling."""
+    flex = FlexDict(DATA)
+    flex.lock()
+    flex = loads(dumps(flex))
+    assert flex == DATA
+    assert flex.locked is True
+    assert flex['a', 'b'].locked is True
+
+
+def test_pickle_partial_lock():
+    """Keeping the lock states of nested dictionaries."""
+    flex = FlexDict(DATA)
+    flex['a'].lock()
+    flex['a', 'b'].unlock()
+    flex['e'].lock()
+    for decoded in (loads(dumps(flex)), FlexDict.from_bytes(flex.to_bytes())):
+        assert decoded == DATA and decoded.locked is False
+        assert decoded['a'].locked is True
+        assert decoded['a', 'b'].locked is False
+        assert decoded['e'].locked is True
+        decoded.lock()
+        assert decoded['a', 'b'].locked is True
+    assert loads(dumps(flex['a'])).locked is True
+    assert loads(dumps(flex['a']))['b'].locked is False
+
+
+def test_pickle_self_reference():
+    """Pickling dictionaries referenced by their own values."""
+    flex = FlexDict({'a': 1})
+    flex['b'] = [flex]
+    decoded = loads(dumps(flex))
+    assert decoded['b'][0] is decoded
+    dict.__setitem__(flex, 'c', flex)
+    with raises(ValueError):
+        flex.to_bytes()
+    with raises(ValueError):
+        dumps(flex)
+
+
+def test_bytes():
+    """Encoding into and decoding from the binary format."""
+    data = {
+        'a': {'b': {'c': -1, 'd': 2 ** 70}, 'e': {}},
+        1: {True: None, 1.5: [1, (u'\u00e9', b'x'), {'f': False}]},
+        (1, 'x'): {'a': {'a': 'a'}, 'g': {3, 4}},
+    }
+    flex = FlexDict(data)
+    flex.lock()
+    decoded = FlexDict.from_bytes(flex.to_bytes())
+    assert decoded == data
+    assert decoded.locked is True
+    assert isinstance(decoded['a', 'e'], FlexDict)
+    assert type(decoded[1][1.5][1]) is tuple
+    assert type(decoded[1][1.5][2]) is dict
+    assert {type(key) for key in decoded[1]} == {bool, float}
+    assert {type(key) for key in decoded} == {str, int, tuple}
+    assert flex_loads(flex_dumps(data)) == data
+    assert flex_loads(flex_dumps(data)).locked is False
+    assert FrozenFlexDict.from_bytes(flex.to_bytes()) == data
+    with raises(ValueError):
+        FlexDict.from_bytes(b'{}')
+    with raises(ValueError):
+        flex_dumps([1])
+
+
+def test_bytes_size():
+    """Storing repeated keys only once."""
+    flex = FlexDict()
+    for i in range(100):
+        flex['item%d' % i, 'description'] = i
+    assert len(flex.to_bytes()) < len(dumps(json_dumps(flex)))
+
+
+def test_pickle_frozen():
+    """Pickling and unpickling frozen snapshots."""
+    frozen = FlexDict(DATA).freeze()
+    assert loads(dumps(frozen)) == frozen
+    assert type(loads(dumps(frozen))['a']) is FrozenFlexDict
+    assert hash(loads(dumps(frozen))) == hash(frozen)
+
+
+def write_mapped(tmpdir, flex):
+    """Writes `flex` into a temporary file and gets its path."""
+    path = str(tmpdir.join('data.flex'))
+    with open(path, 'wb') as fp:
+        flex.write_mapped(fp)
+    return path
+
+
+def test_mapped(tmpdir):
+    """Reading values from a memory-mapped file."""
+    flex = FlexDict(DATA)
+    flex['i', 1, 'j'] = [{'k': 6}]
+    flex[True] = {}
+    with MappedFlexDict(write_mapped(tmpdir, flex)) as mapped:
+        assert mapped['a', 'b', 'c'] == 1
+        assert mapped[['i', 1.0, 'j', 0, 'k']] == 6
+        assert mapped[FlexDict.path('e', 'g')] == 4
+        assert isinstance(mapped['a', 'b'], MappedFlexDict)
+        assert mapped['a', 'b'] == {'c': 1, 'd': 2}
+        assert mapped.get(['a', 'x'], 0) == 0
+        assert mapped.get(1) == {}
+        assert 'a' in mapped and 'x' not in mapped
+        assert len(mapped) == len(flex)
+        assert list(mapped) == list(flex)
+        assert dict(mapped['e'].items()) == {'f': 3, 'g': 4}
+        assert flex == mapped and mapped == flex
+        assert flex['a'] != mapped and flex != 1
+        with raises(KeyError):
+            mapped['a', 'x']  # pylint: disable=W0104
+        with raises(TypeError):
+            mapped[{}]  # pylint: disable=W0104
+
+
+def test_mapped_views(tmpdir):
+    """Listing and searching a memory-mapped file like a FlexDict."""
+    flex = FlexDict(DATA)
+    flex['i', 'c'] = 1
+    flex.lock()
+    with MappedFlexDict(write_mapped(tmpdir, flex)) as mapped:
+        for nested in (False, True):
+            assert mapped.keys(nested) == list(flex.keys(nested))
+            assert mapped.keys(nested, True) == set(flex.keys(nested, True))
+        assert mapped.values(nested=True) == flex.values(nested=True)
+        assert mapped.values(nested=True, unique=True) == {1, 2, 3, 4, 5}
+        assert [
+            value for value in mapped.values()
+            if not isinstance(value, MappedFlexDict)
+        ] == [5]
+        assert mapped.contains({'f': 3}) and mapped.contains({'c': 1})
+        assert mapped.contains({'b': {'c': 1, 'd': 2}})
+        assert not mapped.contains({'b': {'c': 1}})
+        assert not mapped.contains({})
+        assert mapped == flex and mapped != DATA
+        assert mapped.materialize() == flex
+        assert mapped.materialize().locked is True
+        assert mapped['a'].materialize().locked is True
+        assert loads(dumps(mapped['a'])) == flex['a']
+    with MappedFlexDict(write_mapped(tmpdir, FlexDict())) as mapped:
+        assert mapped == {} and mapped.keys(nested=True) == []
+    with raises(ValueError):
+        MappedFlexDict(__file__)
+
+
+def test_key_path():
+    """Getting and setting items with compiled key-paths."""
+    flex = FlexDict(DATA)
+    path = FlexDict.path('a', 'b', 'c')
+    assert isinstance(path, KeyPath)
+    assert flex[path] == 1
+    assert flex.get(path) == 1
+    assert flex.get(FlexDict.path('a', 'x'), default=0) == 0
+    flex[path] = 2
+    flex.set(path, 1, increment=True)
+    assert flex['a', 'b', 'c'] == 3
+    assert {path: 1}[KeyPath('a', 'b', 'c')] == 1
+    assert loads(dumps(path)) == path
+
+
+def test_key_path_error():
+    """Invalid keys for a key-path."""
+    with raises(TypeError):
+        FlexDict.path('a', {'b': 1})
+    with raises(TypeError):
+        FlexDict.path('a', ['b'])
+
+
+def test_get_many():
+    """Getting multiple values at once."""
+    flex = FlexDict(DATA)
+    paths = [
+        ['a', 'b', 'c'], ('a', 'b', 'd'), FlexDict.path('e', 'f'), 'h',
+        ['a', 'x', 'y'], ['e'], []
+    ]
+    assert flex.get_many(paths, default=0) == [
+        1, 2, 3, 5, 0, DATA['e'], DATA
+    ]
+    assert flex == DATA
+
+
+def test_set_many():
+    """Setting multiple values at once."""
+    flex = FlexDict()
+    flex.set_many([
+        (['a', 'b', 'c'], 1),
+        (['a', 'b', 'd'], 2),
+        (['e'], {'f': 3}),
+        (['e', 'g'], 4),
+        ('h', 5),
+        (['x', 'y'], 1),
+        (['x'], 0),
+    ])
+    flex.set_many({('x',): {}})
+    assert flex == dict(DATA, x={})
+
+
+def test_set_many_increment():
+    """Incrementing multiple values at once."""
+    flex = FlexDict(DATA)
+    flex.set_many([(['a', 'b', 'c'], 1), ('h', 2), (['x', 'y'], 3),
+                   (['x', 'y'], 3), ('h', -7)], increment=True)
+    assert flex == dict(DATA, a={'b': {'c': 2, 'd': 2}}, h=0, x={'y': 6})
+    flex.set_many([('h', 1), ('h', 1)], increment=True)
+    assert flex['h'] == 2
+
+
+def test_set_many_locked():
+    """KeyError while setting multiple values of a locked dictionary."""
+    flex = FlexDict(DATA)
+    flex.lock()
+    with raises(KeyError):
+        flex.set_many([(['a', 'b', 'x'], 1), (['z', 'k'], 1)])
+    assert flex['a', 'b', 'x'] == 1
+
+
+@mark.parametrize('cls', [FlexDict, ConcurrentFlexDict])
+def test_set_many_empty_path(cls):
+    """Setting values at empty key-paths."""
+    flex = cls(DATA)
+    with raises(ValueError):
+        flex.set([], 1)
+    with raises(ValueError):
+        flex.set_many([(['x'], 1), ([], 2), (['y'], 3)])
+    assert flex == dict(DATA, x=1)
+
+
+def test_lock_hybrid():
+    """Locking nested dictionaries separately."""
+    flex = FlexDict({'secure': {'a': {}}, 'not_secure': {'b': {}}})
+    flex['secure'].lock()
+    assert flex.locked is False
+    assert flex['secure', 'a'].locked is True
+    assert flex['not_secure', 'b'].locked is False
+    flex.lock()
+    assert flex['not_secure', 'b'].locked is True
+    flex['secure'].unlock()
+    assert flex['secure', 'a'].locked is False
+    assert flex['not_secure'].locked is True
+    flex['secure', 'x', 'y'] = 1
+    assert flex['secure', 'x'].locked is False
+    flex.unlock()
+    assert flex['secure', 'x'].locked is False
+
+
+def test_lock_attribute():
+    """Locking through the attribute."""
+    flex = FlexDict(DATA)
+    flex.locked = True
+    assert flex['a', 'b'].locked is True
+    flex['a'].locked = False
+    assert flex['a', 'b'].locked is False
+    assert flex['e'].locked is True
+
+
+def test_lock_new_items():
+    """Items added to a locked dictionary are locked too."""
+    flex = FlexDict(DATA)
+    flex.lock()
+    flex['x'] = {'y': {}}
+    assert flex['x', 'y'].locked is True
+    with raises(KeyError):
+        flex['x', 'y', 'z']  # pylint: disable=W0104
+
+
+def test_freeze():
+    """Creating frozen snapshots."""
+    flex = FlexDict(DATA)
+    frozen = flex.freeze()
+    assert isinstance(frozen, FrozenFlexDict)
+    assert isinstance(frozen['a', 'b'], FrozenFlexDict)
+    assert frozen == DATA
+    assert frozen.locked is True
+    assert frozen.freeze() is frozen
+    assert loads(dumps(frozen)) == frozen
+    assert isinstance(loads(dumps(frozen)), FrozenFlexDict)
+    with raises(KeyError):
+        frozen['a', 'x']  # pylint: disable=W0104
+
+
+def test_freeze_hash():
+    """Hashing frozen snapshots by content."""
+    first = FlexDict(DATA).freeze()
+    second = FrozenFlexDict(
+        {'h': 5, 'e': {'g': 4, 'f': 3}, 'a': {'b': {'d': 2, 'c': 1}}}
+    )
+    assert first is not second
+    assert hash(first) == hash(second)
+    assert first == second
+    assert len({first: 1, second: 2}) == 1
+    assert first != FlexDict(dict(DATA, h=6)).freeze()
+
+
+def test_freeze_sharing():
+    """Sharing unchanged subtrees between snapshots."""
+    flex = FlexDict(DATA)
+    first = flex.freeze()
+    assert flex.freeze() is first
+    flex['a', 'b', 'c'] = 0
+    second = flex.freeze()
+    assert second['e'] is first['e']
+    assert second['a'] is not first['a']
+    assert first['a', 'b', 'c'] == 1
+    assert second['a', 'b', 'c'] == 0
+
+
+@mark.parametrize('method, args', [
+    ('__setitem__', ('a', 1)),
+    ('__delitem__', ('a',)),
+    ('set', ('a', 1)),
+    ('set_many', ([('a', 1)],)),
+    ('pop', ()),
+    ('merge', ({'c': 2},)),
+    ('merge_many', ([{'z': 1}],)),
+    ('update', ({'a': 1},)),
+    ('__ior__', ({'a': 1},)),
+    ('lock', ()),
+    ('build_index', ()),
+    ('create_index', ('c',)),
+    ('enable_journal', ()),
+])
+def test_freeze_immutable(method, args):
+    """Modifying frozen snapshots."""
+    frozen = FlexDict(DATA).freeze()
+    with raises(TypeError):
+        getattr(frozen, method)(*args)
+    with raises(TypeError):
+        getattr(frozen['a'], method)(*args)
+    assert frozen == DATA
+
+
+def test_freeze_shared_context():
+    """Snapshots sharing subtrees do not share settings."""
+    flex = FlexDict(DATA)
+    first = flex.freeze()
+    flex['h'] = 6
+    second = flex.freeze()
+    with raises(TypeError):
+        second['e'].probing = True
+    assert first['e'].probing is False and flex.probing is False
+    assert second['e'] is first['e'] and second.contains({'f': 3})
+    assert second.find(key='g') == [('e', 'g')]
+
+
+def test_slots():
+    """Nested dictionaries do not carry an instance dictionary."""
+    flex = FlexDict(DATA)
+    assert not hasattr(flex['a'], '__dict__')
+    assert not hasattr(flex.freeze()['a'], '__dict__')
+
+
+def test_load_stream():
+    """Loading JSON documents."""
+    data = dict(DATA, i=[{'j': 1}, [{'k': {}}]], l=None)
+    flex = FlexDict.load_stream(NativeIO(json_dumps(data)))
+    assert flex == data
+    assert isinstance(flex['a', 'b'], FlexDict)
+    assert isinstance(flex['i'][0], FlexDict)
+    assert isinstance(flex['i'][1][0]['k'], FlexDict)
+    flex.lock()
+    assert flex['a', 'b'].locked is True
+
+
+@mark.parametrize('select, result', [
+    ([['a', 'b', 'c']], {'a': {'b': {'c': 1}}}),
+    ([['a', 'b'], 'h'], {'a': {'b': {'c': 1, 'd': 2}}, 'h': 5}),
+    ([['a'], ['a', 'b', 'c']], {'a': {'b': {'c': 1, 'd': 2}}}),
+    ([('e', 'g'), ['e', 'f', 'x']], {'e': {'g': 4}}),
+    ([[]], DATA),
+    ([], {}),
+])
+def test_load_stream_select(select, result):
+    """Loading selected subtrees of JSON documents."""
+    flex = FlexDict.load_stream(NativeIO(json_dumps(DATA)), select=select)
+    assert flex == result
+
+
+def test_load_stream_value_error():
+    """Loading JSON documents which are not objects."""
+    with raises(ValueError):
+        FlexDict.load_stream(NativeIO('[1, 2]'))
+    with raises(ValueError):
+        FlexDict.load_stream(NativeIO('[1, 2]'), select=['a'])
+
+
+def test_iter_jsonl():
+    """Loading JSON Lines records."""
+    lines = NativeIO('\n'.join([json_dumps(DATA), '', json_dumps({'x': 1})]))
+    assert list(FlexDict.iter_jsonl(lines)) == [DATA, {'x': 1}]
+    lines.seek(0)
+    assert list(FlexDict.iter_jsonl(lines, select=['h'])) == [{'h': 5}, {}]
+
+
+def test_load_frozen():
+    """Loading JSON into frozen snapshots."""
+    frozen = FrozenFlexDict.load_stream(NativeIO(json_dumps(DATA)))
+    assert frozen == DATA and type(frozen['a', 'b']) is FrozenFlexDict
+    assert hash(frozen) == hash(
+        FrozenFlexDict.load_stream(NativeIO(json_dumps(DATA)))
+    )
+    lines = NativeIO('\n'.join([json_dumps(DATA), json_dumps({'x': 1})]))
+    records = list(FrozenFlexDict.iter_jsonl(lines, select=['a']))
+    assert records == [{'a': DATA['a']}, {}]
+    assert all(type(record) is FrozenFlexDict for record in records)
+    with raises(TypeError):
+        records[0]['a']['b'] = 1
+
+
+def test_iterflatten():
+    """Lazily flatenning the dictionary."""
+    flex = FlexDict(DATA)
+    assert list(flex.iterflatten()) == flex.flatten()
+    assert sorted(flex.iterflatten(sep='.')) == [
+        ('a.b.c', 1), ('a.b.d', 2), ('e.f', 3), ('e.g', 4), ('h', 5)
+    ]
+
+
+@mark.parametrize('nested', [True, False])
+def test_iterkeys_itervalues(nested):
+    """Lazily getting keys and values."""
+    flex = FlexDict(DATA)
+    assert list(flex.iterkeys(nested=nested)) == list(
+        flex.keys(nested=nested)
+    )
+    assert list(flex.itervalues(nested=nested)) == list(
+        flex.values(nested=nested)
+    )
+
+
+def test_write_csv():
+    """Writing the flattened dictionary as CSV."""
+    flex = FlexDict(DATA)
+    buffer = NativeIO()
+    flex.write_csv(buffer, sep='/')
+    assert sorted(buffer.getvalue().splitlines()) == [
+        'a/b/c,1', 'a/b/d,2', 'e/f,3', 'e/g,4', 'h,5'
+    ]
+
+
+def test_write_jsonl():
+    """Writing the flattened dictionary as JSON Lines."""
+    flex = FlexDict(DATA)
+    buffer = NativeIO()
+    flex.write_jsonl(buffer)
+    buffer.seek(0)
+    assert [
+        (row['path'], row['value'])
+        for row in FlexDict.iter_jsonl(buffer)
+    ] == flex.flatten()
+    buffer = NativeIO()
+    flex.write_jsonl(buffer, sep='.')
+    buffer.seek(0)
+    assert FlexDict.from_flat(
+        record.popitem() for record in FlexDict.iter_jsonl(buffer)
+    ) == {'a.b.c': 1, 'a.b.d': 2, 'e.f': 3, 'e.g': 4, 'h': 5}
+
+
+def test_from_flat():
+    """Unflattening flattened items."""
+    flex = FlexDict(DATA)
+    assert FlexDict.from_flat(flex.flatten()) == DATA
+    assert FlexDict.from_flat(flex.iterflatten(sep='.'), sep='.') == DATA
+    assert FlexDict.from_flat(sorted(flex.flatten(), reverse=True)) == DATA
+    assert FlexDict.from_flat([(u'a.b', 1)], sep=u'.') == {u'a': {u'b': 1}}
+    assert isinstance(FlexDict.from_flat(flex.flatten())['a', 'b'], FlexDict)
+
+
+def test_from_flat_frozen():
+    """Unflattening items into frozen snapshots."""
+    frozen = FrozenFlexDict.from_flat([(('a', 'b'), 1), ('c', 2)])
+    assert frozen == {'a': {'b': 1}, 'c': 2}
+    assert type(frozen['a']) is FrozenFlexDict
+    assert hash(frozen) == hash(FrozenFlexDict.from_flat(frozen.flatten()))
+    with raises(TypeError):
+        frozen['a']['b'] = 99
+
+
+def test_from_flat_order():
+    """Unflattening items in order, like consecutive item assignments."""
+    items = [
+        (('a', 'b', 'c'), 1),
+        (('a', 'b'), {'x': 1}),
+        (('a', 'b', 'y'), 2),
+        ('h', 5),
+        (FlexDict.path('a', 'd'), 3),
+        ([], 0),
+    ]
+    with raises(ValueError):
+        FlexDict.from_flat(items)
+    assert FlexDict.from_flat(items[:-1]) == {
+        'a': {'b': {'x': 1, 'y': 2}, 'd': 3}, 'h': 5
+    }
+    with raises(TypeError):
+        FlexDict.from_flat([('h', 5), (['h', 'x'], 1)])
+
+
+def test_to_columns():
+    """Converting values of many dictionaries into NumPy arrays."""
+    numpy = importorskip('numpy')
+    records = [
+        FlexDict(DATA),
+        FlexDict({'a': {'b': {'c': 1.5}}, 'e': {'f': 'x'}, 'h': 6}),
+        FlexDict({'h': True}),
+    ]
+    columns = FlexDict.to_columns(records)
+    assert sorted(columns) == [
+        ('a', 'b', 'c'), ('a', 'b', 'd'), ('e', 'f'), ('e', 'g'), ('h',)
+    ]
+    assert columns['a', 'b', 'c'].dtype == numpy.float64
+    assert columns['a', 'b', 'c'].tolist() == [1.0, 1.5, None]
+    assert columns['a', 'b', 'd'].dtype == numpy.int64
+    assert columns['a', 'b', 'd'].mask.tolist() == [False, True, True]
+    assert columns['e', 'f'].tolist() == [3, 'x', None]
+    assert columns['h',].tolist() == [5, 6, True]
+    columns = FlexDict.to_columns(
+        records, paths=['h', ['x', 'y']], dtypes={'h': 'float32'}
+    )
+    assert columns[FlexDict.path('h')].dtype == numpy.float32
+    assert columns['x', 'y'].mask.all()
+    columns = FlexDict.to_columns([DATA, {'h': 2 ** 70}, {'h': -2 ** 63}])
+    assert sorted(columns) == sorted(FlexDict.to_columns(records[:1]))
+    assert columns['h',].dtype == object
+    assert columns['h',].tolist() == [5, 2 ** 70, -2 ** 63]
+    columns = FlexDict.to_columns([{'x': 2 ** 63}, {'x': 1.5}])
+    assert columns['x',].tolist() == [2 ** 63, 1.5]
+
+
+def test_from_columns():
+    """Converting NumPy arrays back into dictionaries."""
+    importorskip('numpy')
+    records = [FlexDict(DATA), FlexDict({'a': {'b': {'c': 2}}})]
+    assert FlexDict.from_columns(FlexDict.to_columns(records)) == records
+    assert FlexDict.from_columns({}) == []
+    frozen = FrozenFlexDict.from_columns(FlexDict.to_columns(records))
+    assert frozen == records and type(frozen[1]['a']) is FrozenFlexDict
+
+
+def run_threads(target, count=8):
+    """Runs `target` in `count` threads and waits for them."""
+    threads = [Thread(target=target, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_reads():
+    """Reading a concurrent dictionary without creating nested ones."""
+    flex = ConcurrentFlexDict(DATA)
+    assert flex == DATA
+    assert isinstance(flex['a', 'b'], ConcurrentFlexDict)
+    with raises(KeyError):
+        flex['x', 'y']  # pylint: disable=W0104
+    with raises(KeyError):
+        flex['a']['x']  # pylint: disable=W0104
+    assert flex == DATA
+    assert flex.get(['x', 'y'], 0) == 0
+    flex['x', 'y'] = 1
+    del flex['a', 'b', 'c']
+    assert flex['x'] == {'y': 1}
+    assert flex['a', 'b'] == {'d': 2}
+    flex.lock()
+    with raises(KeyError):
+        flex['z', 'k'] = 1
+    flex = loads(dumps(flex))
+    assert isinstance(flex, ConcurrentFlexDict)
+    assert flex.locked is True
+
+
+def test_concurrent_increment():
+    """Incrementing values from many threads at once."""
+    flex = ConcurrentFlexDict(stripes=4)
+
+    def work(i):
+        for j in range(1000):
+            flex.set(['counts', j % 10], 1, increment=True)
+            flex['threads', i] = j
+            flex['counts'].set('total', 1, increment=True)
+
+    run_threads(work)
+    assert flex['counts', 'total'] == 8000
+    assert all(flex['counts', j] == 800 for j in range(10))
+    assert flex['threads'] == {i: 999 for i in range(8)}
+
+
+def test_concurrent_snapshots():
+    """Flattening a dictionary consistently while it is modified."""
+    flex = ConcurrentFlexDict({'a': 0, 'b': 0})
+    flex.build_index()
+    sums = []
+
+    def work(i):
+        for j in range(300):
+            if i % 2:
+                flex.set_many([('a', j), ('b', -j)])
+            else:
+                sums.append(sum(value for _, value in flex.flatten()))
+
+    run_threads(work)
+    assert set(sums) == {0}
+    assert flex.contains({'a': 299, 'b': -299})
+
+
+def test_concurrent_equality():
+    """Comparing a dictionary while it is modified."""
+    other = {'a': {i: i for i in range(2000)}}
+    flex = ConcurrentFlexDict(other)
+    results = []
+
+    def work(i):
+        for j in range(i * 200, i * 200 + 200):
+            if i % 2:
+                flex.set(['b', j], j)
+                del flex['a', j]
+                flex.set(['a', j], j)
+            else:
+                results.append(flex == other)
+                results.append(flex != other)
+
+    run_threads(work)
+    assert len(results) == 1600
+    assert flex['a'] == other['a']
+
+
+def count_words(line):
+    """Maps a line of text to its word counts."""
+    return [(['words', word], 1) for word in line.split()] + [('lines', 1)]
+
+
+@mark.parametrize('processes', [1, 2])
+def test_aggregate(processes):
+    """Summing values with a pool of processes."""
+    lines = ['a b c', 'b c', 'c'] * 50
+    flex = FlexDict.aggregate(
+        lines, mapper=count_words, processes=processes, chunksize=7
+    )
+    assert flex == {'words': {'a': 50, 'b': 100, 'c': 150}, 'lines': 150}
+    assert isinstance(flex['words'], FlexDict)
+    pairs = [(['x', i % 3], [i]) for i in range(20)]
+    expected = FlexDict()
+    for keys, value in pairs:
+        expected.set(keys, value, increment=True)
+    assert FlexDict.aggregate(
+        pairs, processes=processes, chunksize=3
+    ) == expected
+    assert FlexDict.aggregate([], processes=processes) == {}
+
+
+def test_cached_lru():
+    """Evicting the least recently used leaves of a cache."""
+    cache = CachedFlexDict(maxsize=3)
+    cache['t1', 's1', 'k1'] = 1
+    cache['t1', 's1', 'k2'] = 2
+    cache.set(['t2', 's1', 'k1'], 3)
+    assert cache['t1', 's1', 'k1'] == 1
+    cache['t3'] = {'k': 4}
+    assert cache == {'t1': {'s1': {'k1': 1}}, 't2': {'s1': {'k1': 3}},
+                     't3': {'k': 4}}
+    assert isinstance(cache['t3'], CachedFlexDict)
+    cache['t1']['s2'] = {'k1': 5}
+    cache.set_many([(['t4', 'k'], 6), (['t4', 'k'], 7)])
+    assert cache == {'t1': {'s2': {'k1': 5}}, 't3': {'k': 4}, 't4': {'k': 7}}
+    assert cache.get(['t2', 's1']) is None
+    with raises(KeyError):
+        cache['t2']  # pylint: disable=W0104
+    assert 't2' not in cache
+    assert (cache.hits, cache.misses) == (3, 2)
+    assert (cache.evictions, cache.weight) == (3, 3)
+    del cache['t3']
+    assert cache.weight == 2
+    assert CachedFlexDict({'a': 1, 'b': {'c': 2}}, maxsize=1) == {
+        'b': {'c': 2}
+    }
+
+
+def test_cached_ttl():
+    """Expiring the leaves of a cache."""
+    now = [0]
+    cache = CachedFlexDict(DATA, ttl=10, timer=lambda: now[0])
+    now[0] = 5
+    cache['a', 'b', 'c'] = 0
+    cache.merge({'e': {'x': 1}})
+    assert cache['a', 'b', 'd'] == 2
+    now[0] = 10
+    assert cache.get(['a', 'b', 'd']) is None
+    assert cache == {'a': {'b': {'c': 0}}, 'e': {'x': 1}}
+    assert cache.evictions == 4
+    now[0] = 15
+    cache['y'] = 1
+    assert cache == {'y': 1}
+
+
+def test_cached_pickle():
+    """Pickling caches along with their bounds."""
+    cache = CachedFlexDict({'a': {'b': 'xx'}, 'c': 'yy'}, maxsize=5, weigh=len)
+    cache['a'].lock()
+    decoded = loads(dumps(cache))
+    assert decoded == cache and decoded.weight == 4
+    assert decoded['a'].locked is True and decoded.locked is False
+    decoded['d'] = 'zz'
+    assert (decoded.evictions, decoded.weight) == (1, 4)
+    assert CachedFlexDict.from_bytes(cache.to_bytes())['a'].locked is True
+
+
+def test_cached_weigh():
+    """Bounding a cache by the weight of its leaves."""
+    cache = CachedFlexDict(maxsize=10, weigh=len)
+    cache['a', 'x'] = 'abcd'
+    cache['b'] = [1, 2, 3, 4]
+    cache['c', 'x'] = 'abcdef'
+    assert cache == {'b': [1, 2, 3, 4], 'c': {'x': 'abcdef'}}
+    cache['c', 'x'] = 'abc'
+    assert cache.weight == 7
+    cache['d'] = 'abcdefghijk'
+    assert cache == {} and cache.evictions == 4
+    loaded = loads(dumps(CachedFlexDict({'a': {'b': 1}}, maxsize=1)))
+    assert type(loaded) is CachedFlexDict and loaded['a', 'b'] == 1
+
+
+def test_probe():
+    """Reading missing keys without creating nested dictionaries."""
+    flex = FlexDict(DATA)
+    assert flex.probe(['a', 'b', 'c']) == 1
+    assert flex.probe(['a', 'x', 'y']) is MISSING
+    assert flex.probe('x') is MISSING
+    assert flex.probe(['h', 'x']) is MISSING
+    assert flex.probe(['a', 'b', 'c', 'x', 'y']) is MISSING
+    assert flex == DATA
+    flex.probing = True
+    assert flex.probing is True and flex['a'].probing is True
+    assert flex['x'] is MISSING
+    assert flex['a', 'x', 'y'] is MISSING
+    assert flex['a']['x']['y'] is MISSING
+    assert not flex['x']
+    assert flex == DATA
+    flex['a', 'x', 'y'] = 1
+    assert flex['a', 'x', 'y'] == 1
+    flex['a'].probing = False
+    assert flex['a', 'z'] == {} and flex['e', 'z'] is MISSING
+    flex.lock()
+    assert flex['x'] is MISSING
+    flex.probing = False
+    with raises(KeyError):
+        flex['x']  # pylint: disable=W0104
+    concurrent = ConcurrentFlexDict(DATA)
+    concurrent.probing = True
+    assert concurrent['a', 'x'] is MISSING
+    cache = CachedFlexDict(DATA)
+    assert cache.probe(['h', 'x']) is MISSING
+    assert cache.probe(['a', 'b', 'c']) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_prune():
+    """Removing empty nested dictionaries."""
+    flex = FlexDict(DATA)
+    flex['a', 'x', 'y', 'z']  # pylint: disable=W0104
+    flex['a', 'b', 'w']  # pylint: disable=W0104
+    flex['v'] = {}
+    flex['e', 'u'] = []
+    flex.build_index()
+    assert flex.prune() == 5
+    assert flex == dict(DATA, e={'f': 3, 'g': 4, 'u': []})
+    assert not flex.contains({'w': {}})
+    assert flex.prune() == 0
+    assert FlexDict({'a': {}}).prune() == 1
+    with raises(TypeError):
+        flex.freeze().prune()
+
+
+USERS = {
+    'users': {
+        'u1': {'user_id': 1, 'age': 30, 'tags': ['a']},
+        'u2': {'user_id': 2, 'age': 30, 'tags': ['b']},
+    },
+    'admins': {'user_id': {'id': 1}},
+}
+
+
+@mark.parametrize('indexed', [False, True])
+def test_find(indexed):
+    """Finding values under a key or a key-path pattern."""
+    flex = FlexDict(USERS)
+    if indexed:
+        flex.create_index(key='user_id')
+        flex.create_index(path=['users', '*', 'age'])
+        flex.create_index(path=('users', '*', 'tags'))
+    assert sorted(flex.find(key='user_id')) == [
+        ('admins', 'user_id'), ('users', 'u1', 'user_id'),
+        ('users', 'u2', 'user_id'),
+    ]
+    assert flex.find(key='user_id', value=2) == [('users', 'u2', 'user_id')]
+    assert flex.find(key='user_id', value={'id': 1}) == [
+        ('admins', 'user_id')
+    ]
+    assert isinstance(flex.find(key='user_id', value=2)[0], KeyPath)
+    assert sorted(flex.find(path=['users', '*', 'age'], value=30)) == [
+        ('users', 'u1', 'age'), ('users', 'u2', 'age')
+    ]
+    assert flex.find(path=['users', '*', 'tags'], value=['b']) == [
+        ('users', 'u2', 'tags')
+    ]
+    assert flex.find(path=['users', '*', 'age'], value=31) == []
+    assert flex.find(key='missing') == []
+    with raises(ValueError):
+        flex.find()
+    with raises(ValueError):
+        flex.find(key='user_id', path=['*'])
+
+
+def test_find_updates():
+    """Keeping the indexes of `create_index` up-to-date."""
+    flex = FlexDict(USERS)
+    flex.create_index(key='user_id')
+    flex.create_index(path=['users', '*', 'age'])
+    flex['users', 'u3'] = {'user_id': 1, 'age': 31}
+    flex.set(['users', 'u1', 'age'], 1, increment=True)
+    assert sorted(flex.find(path=['users', '*', 'age'], value=31)) == [
+        ('users', 'u1', 'age'), ('users', 'u3', 'age')
+    ]
+    del flex['users', 'u3']
+    del flex['admins', 'user_id']
+    assert flex.find(key='user_id', value=1) == [('users', 'u1', 'user_id')]
+    assert flex.find(path=['users', '*', 'age'], value=31) == [
+        ('users', 'u1', 'age')
+    ]
+    flex['users', 'u1'] = {}
+    assert flex.find(key='user_id') == [('users', 'u2', 'user_id')]
+    flex.build_index()
+    flex.drop_index(key='user_id')
+    flex.drop_index(path=['users', '*', 'age'])
+    assert flex.contains({'user_id': 2})
+    flex.drop_index()
+    assert flex.find(key='user_id') == [('users', 'u2', 'user_id')]
+
+
+SERVICES = {
+    'services': {
+        'api': {
+            'endpoints': {'a': {'timeout': 1}, 'b': {'x': {'timeout': 2}}},
+            'timeout': 3,
+        },
+        'db': {'endpoints': {'timeout': 4}},
+    },
+    'timeout': 5,
+}
+
+
+@mark.parametrize(
+    'pattern, expected', [
+        (['services', '*', 'endpoints', '**', 'timeout'], [
+            (('services', 'api', 'endpoints', 'a', 'timeout'), 1),
+            (('services', 'api', 'endpoints', 'b', 'x', 'timeout'), 2),
+            (('services', 'db', 'endpoints', 'timeout'), 4),
+        ]),
+        (['*', '*', 'timeout'], [(('services', 'api', 'timeout'), 3)]),
+        (['**', 'x', '**'], [
+            (('services', 'api', 'endpoints', 'b', 'x'), {'timeout': 2}),
+            (('services', 'api', 'endpoints', 'b', 'x', 'timeout'), 2),
+        ]),
+        (('services', 'db'), [
+            (('services', 'db'), SERVICES['services']['db'])
+        ]),
+        ('timeout', [(('timeout',), 5)]),
+        (['**', '**', 'timeout', '**'], [
+            (('services', 'api', 'endpoints', 'a', 'timeout'), 1),
+            (('services', 'api', 'endpoints', 'b', 'x', 'timeout'), 2),
+            (('services', 'api', 'timeout'), 3),
+            (('services', 'db', 'endpoints', 'timeout'), 4),
+            (('timeout',), 5),
+        ]),
+        (['services', 'missing', '**'], []),
+        (['timeout', '*'], []),
+    ]
+)
+def test_query(pattern, expected):
+    """Getting the items at key-paths matching a pattern."""
+    flex = FlexDict(SERVICES)
+    assert flex.query(pattern) == expected
+    assert all(isinstance(path, KeyPath) for path, _ in flex.query(pattern))
+    query = FlexDict.compile_query(
+        *(pattern if isinstance(pattern, (list, tuple)) else [pattern])
+    )
+    assert flex.query(query) == expected
+    assert query.match(SERVICES) == expected
+    assert flex == SERVICES
+
+
+def test_query_many():
+    """Matching a compiled pattern against many dictionaries."""
+    query = Query('**', 'timeout')
+    data = [SERVICES, {}, {'timeout': {'timeout': 6}}]
+    assert query.match_many(data) == [
+        FlexDict(SERVICES).query(['**', 'timeout']), [],
+        [(('timeout',), {'timeout': 6}), (('timeout', 'timeout'), 6)],
+    ]
+    assert len(FlexDict(SERVICES).query(['**'])) == 13
+    assert repr(query) == "Query('**', 'timeout')"
+
+
+def test_cached_constructors():
+    """Tracking the leaves of caches created by the class methods."""
+    flat = FlexDict(DATA).flatten()
+    caches = [
+        CachedFlexDict.from_dict(DATA),
+        CachedFlexDict.from_dict(FlexDict(DATA), copy=False),
+        CachedFlexDict.from_flat(flat),
+        CachedFlexDict.from_bytes(FlexDict(DATA).to_bytes()),
+        CachedFlexDict.load_stream(NativeIO(json_dumps(DATA))),
+        next(CachedFlexDict.iter_jsonl(NativeIO(json_dumps(DATA)))),
+    ]
+    for cache in caches:
+        assert type(cache) is CachedFlexDict and cache == DATA
+        assert cache.weight == 5
+        assert type(cache['a', 'b']) is CachedFlexDict
+    importorskip('numpy')
+    records = CachedFlexDict.from_columns(
+        FlexDict.to_columns([FlexDict(DATA)])
+    )
+    assert records == [DATA] and records[0].weight == 5